@@ -5,7 +5,7 @@ Gerador Automático de Cronogramas de Estudo (versão final com títulos hierár
 - Leitura de lista_de_temas.xlsx e lista_de_aulas.xlsx (pandas, openpyxl).
 - Filtro por tipo de prova com pesos; módulos com peso 0 são excluídos.
 - Simulação diária com fases (Início/Meio/Final/Pré-prova) e cotas A/Q/R; empréstimos; carryover; resíduos.
-- Revisão espaçada D+1,3,7,14,30 com realocação para o próximo dia de estudo.
+- Revisão espaçada D+1,3,7,14,30 com realocação para o próximo dia de estudo (calculada sob demanda a partir da alocação).
 - Remoção iterativa por prioridade se não couber (menor peso; empate maior carga horária).
 - Geração de DOCX A4 (python-docx), com:
   * Capa (PNG).
@@ -13,17 +13,31 @@ Gerador Automático de Cronogramas de Estudo (versão final com títulos hierár
   * Orientações (aplica Heading 1 no título; incorpora DOCX/PNG; referencia PDF).
   * Cronograma semanal com hierarquia de títulos: Semana = Heading 1; Dia de estudo = Heading 2.
   * Checklist de módulos removidos quando abreviado.
-- Template .dotx: documento pode ser criado a partir do template; no Windows, após salvar,
-  os estilos do template são anexados e copiados via Word COM (se disponível).
+- Template .dotx: estilos (títulos, docDefaults), tema e numeração do template são mesclados em Python puro
+  antes de salvar; o Word COM só é usado se o template não puder ser lido.
+- Orientações em PDF como imagens SVG com PNG de contingência (opção "orientacoes_vetoriais"; requer PyMuPDF).
+- Artefatos montados numa pasta de rascunho local e publicados por os.replace; cópias para outro
+  volume (OneDrive, rede) em thread de E/S em segundo plano ("pasta_temporaria", "copia_em_segundo_plano").
 - Conversão a PDF: tenta docx2pdf; se falhar, tenta Word COM; caso contrário mantém apenas DOCX.
 - Memória de inputs em scheduler_config.json no diretório do script.
+- Visualização HTML (iter_plan_html): mesmo conteúdo da contracapa e do cronograma, em blocos por semana.
+- Prévia rápida (botão "Pré-visualizar"): simulação completa, mas DOCX só com a contracapa e as primeiras semanas.
+- Modo servidor (--serve): HTTP local com pool de processos que mantém planilhas, template e
+  rasters das orientações residentes; jobs em JSON no formato do scheduler_config.json.
+- Exportações para sistemas (chave "exportar" ou --exportar): JSON Lines, Parquet (pyarrow) e iCalendar (.ics).
+- Plano serializado (dump_plan/load_plan, --salvar-plano/--renderizar): renderização em outro processo ou dia, sem simular.
+- Banco da turma em SQLite (CohortStore, --banco): consultas por data, módulo e offset (--quem-revisa, --quem-assiste).
+- Métricas operacionais no formato do Prometheus: GET /metrics no modo servidor ou --metricas ARQUIVO.
 
 Dependências:
   pip install pandas openpyxl python-docx python-dateutil docx2pdf pywin32
+  (opcional) pip install pyarrow  # exportação Parquet
+  (opcional) pip install msgpack  # plano serializado mais compacto (sem ele: JSON comprimido)
 
 Observações:
 - Datas no formato DD/MM/AAAA.
 - “Dias de estudo por semana” é numérico; dias fixos podem ser definidos nas configurações avançadas.
+- Feriados ("feriados") e períodos sem estudo ("bloqueios") podem ser listados no scheduler_config.json.
 - Estrutura das planilhas conforme especificação.
 """
 import subprocess  # para taskkill no Windows
@@ -31,14 +45,25 @@ from docx.shared import Pt, Cm, RGBColor
 import os
 import json
 import math
+import hashlib
+import html
+import heapq
 import sys
 import traceback
+import time
+import threading
+import asyncio
+import contextlib
+import queue
+import shutil
 from datetime import datetime, timedelta, date
 from collections import defaultdict, OrderedDict
+from bisect import bisect_left, bisect_right
 from typing import Optional
 from docx.oxml import OxmlElement
 from docx.oxml.ns import qn
 import tempfile
+import io
 from docx.enum.section import WD_SECTION
 from docx.shared import Inches
 from docx.shared import Cm
@@ -513,6 +538,84 @@ def export_excel_schedule(out_xlsx_path, daily, study_days, exam_date):
 
 # ===== FIM DA FUNÇÃO NOVA =====
 
+# ===== LEITURA DAS PLANILHAS DE PROGRESSO DEVOLVIDAS PELOS ALUNOS =====
+
+PROGRESS_COLUMNS = [
+    "aluno", "semana", "tema", "aula", "data_prevista", "assistida", "questoes",
+    "desempenho", "rev_d1", "rev_d7", "rev_d30", "rev_d90"
+]
+
+def _as_checked(v) -> bool:
+    # Mesma regra das formatações condicionais: TRUE, 1, "TRUE" ou "VERDADEIRO"
+    if isinstance(v, bool):
+        return v
+    if isinstance(v, (int, float)):
+        return v == 1
+    return isinstance(v, str) and v.strip().upper() in ("TRUE", "VERDADEIRO")
+
+def read_progress_workbook(path: str, aluno: Optional[str] = None):
+    """
+    Lê uma planilha "Cronograma" devolvida pelo aluno (modo read-only/streaming do openpyxl),
+    apenas colunas A–R a partir da linha 3. Retorna uma tupla por aula na ordem de PROGRESS_COLUMNS.
+    Semana e Tema são mesclados na planilha e por isso são propagados para as linhas seguintes.
+    """
+    from openpyxl import load_workbook as _load
+    aluno = aluno or os.path.splitext(os.path.basename(path))[0]
+    wb = _load(path, read_only=True, data_only=True)
+    try:
+        ws = wb["Cronograma"] if "Cronograma" in wb.sheetnames else wb.active
+        rows = []
+        semana = tema = None
+        for r in ws.iter_rows(min_row=3, max_col=18, values_only=True):
+            r = tuple(r) + (None,) * (18 - len(r))
+            semana = r[0] if r[0] not in (None, "") else semana
+            tema = r[1] if r[1] not in (None, "") else tema
+            if r[2] in (None, ""):
+                continue
+            data_prev = r[3].date() if isinstance(r[3], datetime) else r[3]
+            desempenho = r[6] if r[6] and str(r[6]).lower() != "(inserir desempenho)" else None
+            rows.append((
+                aluno, semana, tema, str(r[2]), data_prev,
+                _as_checked(r[4]), _as_checked(r[5]), desempenho,
+                _as_checked(r[8]), _as_checked(r[11]), _as_checked(r[14]), _as_checked(r[17]),
+            ))
+        return rows
+    finally:
+        wb.close()
+
+def _read_progress_safe(path: str):
+    try:
+        return path, read_progress_workbook(path), None
+    except Exception as e:
+        return path, [], f"{type(e).__name__}: {e}"
+
+def ingest_progress_workbooks(paths, workers: Optional[int] = None):
+    """
+    Agrega muitas planilhas de progresso em paralelo (pool de processos).
+    Retorna (DataFrame por aluno/aula, {arquivo: erro}) para análises da turma.
+    """
+    from concurrent.futures import ProcessPoolExecutor
+    paths = list(paths)
+    workers = workers or os.cpu_count() or 1
+    rows, errors = [], {}
+    with contextlib.ExitStack() as stack:
+        if workers <= 1 or len(paths) <= 1:
+            results = map(_read_progress_safe, paths)
+        else:
+            pool = stack.enter_context(ProcessPoolExecutor(max_workers=workers))
+            results = pool.map(_read_progress_safe, paths, chunksize=max(1, len(paths) // (workers * 4)))
+        for path, file_rows, err in results:
+            rows.extend(file_rows)
+            if err:
+                errors[path] = err
+
+    df = pd.DataFrame.from_records(rows, columns=PROGRESS_COLUMNS)
+    for col in ("aluno", "semana", "tema", "aula", "desempenho"):
+        df[col] = df[col].astype("category")
+    df["data_prevista"] = pd.to_datetime(df["data_prevista"], errors="coerce")
+    return df, errors
+
+
 def format_day_with_name(d: date) -> str:
     # Retorna "Segunda-feira (DD/MM)"
     return f"{WEEKDAY_NAMES_PT[d.weekday()]} ({d.strftime('%d/%m')})"
@@ -536,12 +639,12 @@ def kill_office_processes():
         except Exception:
             pass
 
-def _resolve_orient_source(orient_path: str | None) -> Optional[str]:
+def _resolve_orient_source(orient_path: str | None, interactive: bool = True) -> Optional[str]:
     """
     Resolve a fonte das orientações segundo a regra:
       1) Se o caminho fornecido existir, usa-o.
       2) Se não existir, tenta 'revisao_espacada_orientacoes.docx' no diretório do script.
-      3) Se ainda não encontrar, abre GUI para o usuário selecionar PDF, DOCX ou PNG,
+      3) Se ainda não encontrar (e interactive=True), abre GUI para o usuário selecionar PDF, DOCX ou PNG,
          e memoriza o caminho escolhido em scheduler_config.json.
     """
     try_path = orient_path if orient_path else ""
@@ -553,6 +656,9 @@ def _resolve_orient_source(orient_path: str | None) -> Optional[str]:
     if os.path.isfile(cand_docx):
         return cand_docx
 
+    if not interactive:
+        return None
+
     # Abre GUI de seleção e memoriza o último input do usuário
     try:
         # cria root oculto para filedialog
@@ -574,16 +680,202 @@ def _resolve_orient_source(orient_path: str | None) -> Optional[str]:
     return None
 
 
+# --- CACHE RESIDENTE DE INSUMOS (planilhas, template, capa, rasters das orientações) ---
+# Chaves incluem caminho absoluto, mtime e tamanho: arquivo alterado = nova entrada.
+# LRU limitado: em processos longos (servidor, observador do catálogo) as versões antigas saem sozinhas.
+RESIDENT_CACHE_SIZE = 64
+
+class ResidentCache:
+    """Dicionário LRU com limite de entradas e trava (usado também pelas threads de pré-carregamento)."""
+
+    def __init__(self, maxsize: int = RESIDENT_CACHE_SIZE):
+        self.maxsize = maxsize
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key, default=None):
+        with self._lock:
+            if key not in self._data:
+                return default
+            self._data.move_to_end(key)
+            return self._data[key]
+
+    def __setitem__(self, key, value):
+        with self._lock:
+            self._data[key] = value
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def __len__(self):
+        return len(self._data)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+_RESIDENT_CACHE = ResidentCache()
+# Acertos/faltas do cache de rasters das orientações neste processo (métricas)
+_ORIENT_CACHE_STATS = {"hit": 0, "miss": 0}
+
+def _file_key(path: str):
+    st = os.stat(path)
+    return (os.path.abspath(path), st.st_mtime_ns, st.st_size)
+
+def read_file_cached(path: str) -> bytes:
+    key = ("bytes", _file_key(path))
+    data = _RESIDENT_CACHE.get(key)
+    if data is None:
+        with open(path, "rb") as f:
+            data = f.read()
+        _RESIDENT_CACHE[key] = data
+    return data
+
+def content_hash(path: str) -> str:
+    key = ("sha1", _file_key(path))
+    digest = _RESIDENT_CACHE.get(key)
+    if digest is None:
+        digest = hashlib.sha1(read_file_cached(path)).hexdigest()
+        _RESIDENT_CACHE[key] = digest
+    return digest
+
+# Resolução da capa pré-escalada para a página (A4 por padrão)
+COVER_DPI = 150
+
+def prepared_cover_bytes(capa_path: str, width_in: float = 21.0 / 2.54, height_in: float = 29.7 / 2.54,
+                         dpi: int = COVER_DPI) -> bytes:
+    """
+    Capa reduzida ao tamanho da página na resolução escolhida, codificada uma única vez e reutilizada
+    (chave = hash do conteúdo) por todos os documentos do processo. Sem Pillow, ou se a imagem já for
+    menor que o alvo, usa os bytes originais sem decodificar.
+    """
+    key = ("capa", content_hash(capa_path), round(width_in, 3), round(height_in, 3), dpi)
+    data = _RESIDENT_CACHE.get(key)
+    if data is not None:
+        return data
+    data = read_file_cached(capa_path)
+    try:
+        from PIL import Image
+        target = (max(1, round(width_in * dpi)), max(1, round(height_in * dpi)))
+        with Image.open(io.BytesIO(data)) as im:
+            if im.size[0] > target[0] or im.size[1] > target[1]:
+                if im.mode not in ("RGB", "RGBA", "L"):
+                    im = im.convert("RGBA")
+                buf = io.BytesIO()
+                im.resize(target, Image.LANCZOS).save(buf, format="PNG", optimize=True)
+                data = buf.getvalue()
+    except Exception:
+        pass
+    _RESIDENT_CACHE[key] = data
+    return data
+
+def rasterize_pdf_pages(pdf_path: str, dpi: int = 216):
+    """
+    Rasteriza as páginas do PDF em PNG (bytes) uma única vez por conteúdo/DPI.
+    Retorna lista de (png_bytes, largura_pol, altura_pol); lista vazia se não houver rasterizador.
+    """
+    key = ("pdf_raster", content_hash(pdf_path), dpi)
+    pages = _RESIDENT_CACHE.get(key)
+    if pages is not None:
+        _ORIENT_CACHE_STATS["hit"] += 1
+        return pages
+    _ORIENT_CACHE_STATS["miss"] += 1
+
+    pages = []
+    try:
+        import fitz  # PyMuPDF
+        with fitz.open(pdf_path) as pdf:
+            zoom = dpi / 72.0
+            for page in pdf:
+                w_in = float(page.rect.width) / 72.0
+                h_in = float(page.rect.height) / 72.0
+                pix = page.get_pixmap(matrix=fitz.Matrix(zoom, zoom))
+                pages.append((pix.tobytes("png"), w_in, h_in))
+    except Exception:
+        try:
+            from pdf2image import convert_from_path
+            a4_w_in, a4_h_in = 8.27, 11.69
+            pages = []
+            for img in convert_from_path(pdf_path, dpi=dpi):
+                buf = io.BytesIO()
+                img.save(buf, format="PNG")
+                pages.append((buf.getvalue(), a4_w_in, a4_h_in))
+        except Exception:
+            pages = []
+
+    if pages:
+        _RESIDENT_CACHE[key] = pages
+    return pages
+
+# Resolução da imagem PNG de contingência que acompanha cada página vetorial (leitores sem SVG)
+ORIENT_VECTOR_FALLBACK_DPI = 72
+SVG_BLIP_EXT_URI = "{96DAC541-7B7A-43D3-8B79-37D633B846F1}"
+
+def vectorize_pdf_pages(pdf_path: str, fallback_dpi: int = ORIENT_VECTOR_FALLBACK_DPI):
+    """
+    Converte cada página do PDF em SVG (texto como contornos, nítido em qualquer zoom) mais um PNG
+    leve de contingência, uma única vez por conteúdo. Retorna lista de (svg_bytes, png_bytes,
+    largura_pol, altura_pol); lista vazia sem PyMuPDF.
+    """
+    key = ("pdf_svg", content_hash(pdf_path), fallback_dpi)
+    pages = _RESIDENT_CACHE.get(key)
+    if pages is not None:
+        _ORIENT_CACHE_STATS["hit"] += 1
+        return pages
+    _ORIENT_CACHE_STATS["miss"] += 1
+
+    pages = []
+    try:
+        import fitz  # PyMuPDF
+        with fitz.open(pdf_path) as pdf:
+            zoom = fallback_dpi / 72.0
+            for page in pdf:
+                svg = page.get_svg_image(text_as_path=True).encode("utf-8")
+                pix = page.get_pixmap(matrix=fitz.Matrix(zoom, zoom))
+                pages.append((svg, pix.tobytes("png"), float(page.rect.width) / 72.0, float(page.rect.height) / 72.0))
+    except Exception:
+        pages = []
+
+    if pages:
+        _RESIDENT_CACHE[key] = pages
+    return pages
+
+def _add_svg_picture(doc: Document, run, svg_bytes: bytes, png_bytes: bytes, width):
+    """
+    Imagem vetorial como o Word grava: a:blip aponta para o PNG (contingência) e a extensão
+    asvg:svgBlip aponta para a parte SVG. Leitores sem suporte a SVG exibem o PNG.
+    """
+    from docx.opc.constants import RELATIONSHIP_TYPE as RT
+    from docx.opc.packuri import PackURI
+    from docx.opc.part import Part
+    from docx.oxml import parse_xml
+
+    inline = run.add_picture(io.BytesIO(png_bytes), width=width)
+    part = doc.part
+    svg_part = Part(part.package.next_partname("/word/media/image%d.svg"), "image/svg+xml", svg_bytes, part.package)
+    rid = part.relate_to(svg_part, RT.IMAGE)
+    blip = inline._inline.xpath(".//a:blip")[0]
+    blip.append(parse_xml(
+        '<a:extLst xmlns:a="http://schemas.openxmlformats.org/drawingml/2006/main">'
+        f'<a:ext uri="{SVG_BLIP_EXT_URI}">'
+        '<asvg:svgBlip xmlns:asvg="http://schemas.microsoft.com/office/drawing/2016/SVG/main" '
+        'xmlns:r="http://schemas.openxmlformats.org/officeDocument/2006/relationships" '
+        f'r:embed="{rid}"/></a:ext></a:extLst>'
+    ))
+    return inline
+
 # --- SUBSTITUA A FUNÇÃO POR ESTA VERSÃO COM FULL-BLEED ---
 
-def _insert_pdf_as_images(doc: Document, pdf_path: str, full_bleed: bool = False):
+def _insert_pdf_as_images(doc: Document, pdf_path: str, full_bleed: bool = False, vector: bool = False):
     """
     Insere todas as páginas do PDF como imagens.
     Em full_bleed, cada página é colocada em sua própria seção sem margens,
     e ao final as margens originais são restauradas em uma nova seção.
+    Em vector, as páginas entram como SVG (com PNG leve de contingência); sem PyMuPDF, volta aos rasters.
     """
     pages_png = []
     page_sizes_in = []
+    pages_svg = []
     def _begin_full_bleed_section(doc: Document, w_in: float, h_in: float):
         base = doc.sections[-1]
         snapshot = {
@@ -619,33 +911,15 @@ def _insert_pdf_as_images(doc: Document, pdf_path: str, full_bleed: bool = False
         sec.header_distance = snapshot["header_distance"]
         sec.footer_distance = snapshot["footer_distance"]
 
-    try:
-        import fitz  # PyMuPDF
-        with fitz.open(pdf_path) as pdf:
-            for page in pdf:
-                w_in = float(page.rect.width) / 72.0
-                h_in = float(page.rect.height) / 72.0
-                page_sizes_in.append((w_in, h_in))
-                dpi = 216
-                zoom = dpi / 72.0
-                pix = page.get_pixmap(matrix=fitz.Matrix(zoom, zoom))
-                tmp = tempfile.NamedTemporaryFile(delete=False, suffix=".png")
-                tmp.write(pix.tobytes("png"))
-                tmp.flush()
-                tmp.close()
-                pages_png.append(tmp.name)
-    except Exception:
-        try:
-            from pdf2image import convert_from_path
-            images = convert_from_path(pdf_path, dpi=216)
-            a4_w_in, a4_h_in = 8.27, 11.69
-            for img in images:
-                tmp = tempfile.NamedTemporaryFile(delete=False, suffix=".png")
-                img.save(tmp.name, format="PNG")
-                pages_png.append(tmp.name)
-                page_sizes_in.append((a4_w_in, a4_h_in))
-        except Exception:
-            pages_png = []
+    if vector:
+        for svg_bytes, png_bytes, w_in, h_in in vectorize_pdf_pages(pdf_path):
+            pages_svg.append(svg_bytes)
+            pages_png.append(png_bytes)
+            page_sizes_in.append((w_in, h_in))
+    if not pages_png:
+        for png_bytes, w_in, h_in in rasterize_pdf_pages(pdf_path):
+            pages_png.append(png_bytes)
+            page_sizes_in.append((w_in, h_in))
 
     if not pages_png:
         doc.add_paragraph(f"Não foi possível incorporar o PDF. Consulte o arquivo em: {pdf_path}")
@@ -653,7 +927,7 @@ def _insert_pdf_as_images(doc: Document, pdf_path: str, full_bleed: bool = False
 
     restore_snapshot = None
 
-    for idx, png_path in enumerate(pages_png):
+    for idx, png_bytes in enumerate(pages_png):
         w_in, h_in = page_sizes_in[idx] if idx < len(page_sizes_in) else (8.27, 11.69)
 
         if full_bleed:
@@ -674,7 +948,10 @@ def _insert_pdf_as_images(doc: Document, pdf_path: str, full_bleed: bool = False
         p.alignment = WD_ALIGN_PARAGRAPH.CENTER
         run = p.add_run()
         try:
-            run.add_picture(png_path, width=Inches(w_in))
+            if idx < len(pages_svg):
+                _add_svg_picture(doc, run, pages_svg[idx], png_bytes, Inches(w_in))
+            else:
+                run.add_picture(io.BytesIO(png_bytes), width=Inches(w_in))
         except Exception:
             doc.add_paragraph(f"[Falha ao inserir a imagem renderizada da página {idx+1} do PDF]")
 
@@ -684,12 +961,6 @@ def _insert_pdf_as_images(doc: Document, pdf_path: str, full_bleed: bool = False
     if full_bleed and restore_snapshot is not None:
         _end_full_bleed_section(doc, restore_snapshot)
 
-    for png_path in pages_png:
-        try:
-            os.remove(png_path)
-        except Exception:
-            pass
-
 def _insert_docx_preserving_basic_layout(doc: Document, src_docx_path: str):
     """
     Copia o conteúdo de um DOCX preservando diagramação básica: headings, parágrafos, alinhamento,
@@ -738,11 +1009,11 @@ def _insert_docx_preserving_basic_layout(doc: Document, src_docx_path: str):
                 t_dst.cell(i, j).text = cell_text
         doc.add_paragraph("")
 
-def add_orientacoes(doc: Document, orient_path: Optional[str]):
+def add_orientacoes(doc: Document, orient_path: Optional[str], interactive: bool = True, vector: bool = False):
     # Incorpora as orientações diretamente, sem título prévio.
-    # Suporta PDF (full-bleed), DOCX (parágrafos/tabelas) e PNG (imagem centrada).
+    # Suporta PDF (full-bleed; vector=True embute as páginas como SVG), DOCX (parágrafos/tabelas) e PNG (imagem centrada).
     try:
-        resolved = _resolve_orient_source(orient_path)
+        resolved = _resolve_orient_source(orient_path, interactive=interactive)
         if not resolved or not os.path.isfile(resolved):
             doc.add_paragraph("Arquivo de orientações não encontrado. Prossiga consultando o material externo.")
             doc.add_page_break()
@@ -750,7 +1021,7 @@ def add_orientacoes(doc: Document, orient_path: Optional[str]):
 
         ext = os.path.splitext(resolved)[1].lower()
         if ext == ".pdf":
-            _insert_pdf_as_images(doc, resolved, full_bleed=True)
+            _insert_pdf_as_images(doc, resolved, full_bleed=True, vector=vector)
         elif ext == ".docx":
             _insert_docx_preserving_basic_layout(doc, resolved)
         elif ext == ".png":
@@ -808,34 +1079,38 @@ def week_start(d: date) -> date:
     # Domingo como início de semana
     return d - timedelta(days=(d.weekday() + 1) % 7)
 
-def generate_study_days(dini: date, dprova: date, dias_por_semana: int, custom_weekdays=None):
-    # custom_weekdays: conjunto de inteiros 0..6 para seg..dom; se None, usa primeiros N dias no intervalo semanal
-    if dias_por_semana <= 0:
+def generate_study_days(dini: date, dprova: date, dias_por_semana: int, custom_weekdays=None,
+                        holidays=None, blackouts=None):
+    """
+    Calendário vetorizado (NumPy, máscaras de dias úteis).
+    - custom_weekdays: conjunto de inteiros 0..6 para seg..dom; se None, usa os primeiros N dias
+      disponíveis de cada semana (semana iniciando no domingo) dentro do intervalo.
+    - holidays: datas sem estudo (feriados, plantões); blackouts: intervalos (início, fim) inclusivos (férias).
+      Dias bloqueados não contam para os N dias da semana.
+    """
+    import numpy as np
+    if dias_por_semana <= 0 or dprova < dini:
         return []
-    study_days = []
-    cur = dini
-    while cur <= dprova:
-        start = week_start(cur)
-        week_days = []
-        if custom_weekdays:
-            for i in range(7):
-                candidate = start + timedelta(days=i)
-                if candidate < dini or candidate > dprova:
-                    continue
-                if candidate.weekday() in custom_weekdays:  # 0=Seg … 6=Dom
-                    week_days.append(candidate)
-        else:
-            for i in range(7):
-                candidate = start + timedelta(days=i)
-                if candidate < dini or candidate > dprova:
-                    continue
-                week_days.append(candidate)
-            week_days.sort()
-            week_days = week_days[:dias_por_semana]
-        study_days.extend([d for d in week_days if d >= dini and d <= dprova])
-        cur = start + timedelta(days=7)
-    study_days = sorted(list(OrderedDict.fromkeys(study_days)))
-    return study_days
+    days = np.arange(np.datetime64(dini, "D"), np.datetime64(dprova, "D") + 1)
+
+    excluded = [np.datetime64(h, "D") for h in (holidays or [])]
+    for b0, b1 in (blackouts or []):
+        excluded.extend(np.arange(np.datetime64(b0, "D"), np.datetime64(b1, "D") + 1))
+    excluded = np.array(excluded, dtype="datetime64[D]")
+
+    if custom_weekdays:
+        weekmask = "".join("1" if i in custom_weekdays else "0" for i in range(7))  # 0=Seg … 6=Dom
+        mask = np.is_busday(days, weekmask=weekmask, holidays=excluded)
+        return days[mask].astype(object).tolist()
+
+    days = days[~np.isin(days, excluded)] if excluded.size else days
+    if days.size == 0:
+        return []
+    # Semana iniciando no domingo (1970-01-04 foi domingo = dia 3 da época)
+    week_id = (days.astype(np.int64) + 4) // 7
+    _, first_idx, counts = np.unique(week_id, return_index=True, return_counts=True)
+    rank = np.arange(days.size) - np.repeat(first_idx, counts)
+    return days[rank < dias_por_semana].astype(object).tolist()
 
 def determine_phase(idx: int, total_days: int) -> str:
     if total_days == 0:
@@ -850,31 +1125,193 @@ def determine_phase(idx: int, total_days: int) -> str:
     else:
         return "preprova"
 
-def normalize_reviews(reviews_raw, study_days):
-    from collections import defaultdict
-    study_days_set = set(study_days)
-    last = max(study_days)
-    reviews = defaultdict(list)
+class LazyReviews:
+    """
+    Revisões espaçadas calculadas sob demanda a partir da alocação (daily) e dos offsets.
+    Uma revisão com data bruta (assistida + offset) fora de um dia de estudo vai para o PRÓXIMO
+    dia de estudo; se passar do último dia de estudo, é omitida do DOCX/PDF.
+    Interface compatível com o antigo dicionário de revisões: reviews.get(d, []).
+    skip: conjunto de (modulo, aula, data assistida) cujas revisões não devem ser geradas
+    (ex.: aulas não concluídas que foram realocadas no replanejamento).
+    """
 
-    for t_raw, items in reviews_raw.items():
-        # Casos com data de revisão DEPOIS do último dia de estudo: omite do DOCX/PDF.
-        if t_raw > last:
-            continue
+    def __init__(self, daily, study_days, review_offsets, peso_map, skip=None):
+        self._daily = daily
+        self._days = list(study_days)
+        self._offsets = sorted({int(o) for o in (review_offsets or [])})
+        self._peso_map = peso_map
+        self._skip = set(skip or ())
+        self._lesson_day = None
+
+    def _item(self, lesson, watched, offset):
+        # offset: intervalo configurado (D+offset) que gerou a revisão, mesmo se ela rolou para outro dia
+        return {
+            "aula": lesson["aula"],
+            "modulo": lesson["modulo"],
+            "watched_date": watched,
+            "peso": int(self._peso_map.get(lesson["modulo"], 0)),
+            "offset": offset
+        }
 
-        # Data de revisão exatamente em um dia de estudo: mantém.
-        if t_raw in study_days_set:
-            reviews[t_raw].extend(items)
+    def _landing_day(self, t_raw: date) -> Optional[date]:
+        pos = bisect_left(self._days, t_raw)
+        return self._days[pos] if pos < len(self._days) else None
+
+    def for_day(self, d: date):
+        # Revisões que caem em d: data bruta no intervalo (dia de estudo anterior, d]
+        pos = bisect_left(self._days, d)
+        if pos >= len(self._days) or self._days[pos] != d:
+            return []
+        prev = self._days[pos - 1] if pos > 0 else None
+        found = []
+        for off in self._offsets:
+            delta = timedelta(days=off)
+            i_end = bisect_right(self._days, d - delta)
+            i_start = bisect_right(self._days, prev - delta) if prev is not None else 0
+            for w in self._days[i_start:i_end]:
+                for lesson in self._daily[w]["A_lessons"]:
+                    if self._skip and (lesson["modulo"], lesson["aula"], w) in self._skip:
+                        continue
+                    found.append((w + delta, self._item(lesson, w, off)))
+        found.sort(key=lambda t: t[0])
+        return [item for _, item in found]
+
+    def for_lesson(self, aula: str, modulo: Optional[str] = None):
+        # Lista de (dia de estudo, item) para cada revisão da aula
+        if self._lesson_day is None:
+            self._lesson_day = {}
+            for w in self._days:
+                for lesson in self._daily[w]["A_lessons"]:
+                    if self._skip and (lesson["modulo"], lesson["aula"], w) in self._skip:
+                        continue
+                    self._lesson_day[(lesson["modulo"], lesson["aula"])] = (w, lesson)
+        hits = [v for k, v in self._lesson_day.items() if k[1] == aula and (modulo is None or k[0] == modulo)]
+        out = []
+        for w, lesson in hits:
+            for off in self._offsets:
+                landing = self._landing_day(w + timedelta(days=off))
+                if landing is not None:
+                    out.append((landing, self._item(lesson, w, off)))
+        return out
+
+    def get(self, d: date, default=None):
+        items = self.for_day(d)
+        return items if items else (default if default is not None else [])
+
+    def __getitem__(self, d: date):
+        return self.for_day(d)
+
+    def items(self):
+        for d in self._days:
+            items = self.for_day(d)
+            if items:
+                yield d, items
+
+# Nivelamento de revisões: minutos estimados por item e janela de tolerância (em dias de estudo)
+REVIEW_MINUTES_PER_ITEM = 5
+REVIEW_TOLERANCE_DAYS = 2
+
+class LeveledReviews:
+    """Revisões já redistribuídas respeitando a capacidade diária; mesma interface de LazyReviews."""
+
+    def __init__(self, by_day, deferrals, overflow):
+        self._by_day = by_day
+        self.deferrals = deferrals  # itens movidos de dia: {"aula", "modulo", "peso", "due", "placed", "shift"}
+        self.overflow = overflow    # itens sem vaga na janela (mantidos no dia devido, acima da cota)
+        self._lesson_days = None
+
+    def for_lesson(self, aula: str, modulo: Optional[str] = None):
+        # Lista de (dia de estudo, item) para cada revisão da aula, já no dia nivelado
+        if self._lesson_days is None:
+            self._lesson_days = defaultdict(list)
+            for d, items in self._by_day.items():
+                for it in items:
+                    self._lesson_days[(it["modulo"], it["aula"])].append((d, it))
+        return [hit for k, hits in self._lesson_days.items()
+                if k[1] == aula and (modulo is None or k[0] == modulo) for hit in hits]
+
+    def for_day(self, d: date):
+        return list(self._by_day.get(d, []))
+
+    def get(self, d: date, default=None):
+        items = self.for_day(d)
+        return items if items else (default if default is not None else [])
+
+    def __getitem__(self, d: date):
+        return self.for_day(d)
+
+    def items(self):
+        for d, items in self._by_day.items():
+            if items:
+                yield d, list(items)
+
+def _find_free(parent, i):
+    # Busca com compressão de caminho: próximo índice com vaga
+    root = i
+    while parent[root] != root:
+        root = parent[root]
+    while parent[i] != root:
+        parent[i], i = root, parent[i]
+    return root
+
+def level_reviews(daily, study_days, reviews, minutes_per_item: int = REVIEW_MINUTES_PER_ITEM,
+                  tolerance: int = REVIEW_TOLERANCE_DAYS) -> LeveledReviews:
+    """
+    Distribui as revisões respeitando a cota diária derivada de R_min (R_min // minutes_per_item itens).
+    Fila de prioridade por (dia devido, maior peso): itens mais pesados ficam no dia devido e o
+    excedente vai para o dia de estudo mais próximo com vaga dentro de ±tolerance (empate: adia),
+    nunca antes do dia seguinte ao que a aula foi assistida. Vagas localizadas por union-find
+    (próximo dia livre à direita/à esquerda): O(R log R) no total, sem varrer dia a dia.
+    """
+    n = len(study_days)
+    pos = {d: i for i, d in enumerate(study_days)}
+    free = [int(daily[d]["R_min"] // max(1, minutes_per_item)) for d in study_days]
+
+    heap = []
+    seq = 0
+    for d, items in reviews.items():
+        for it in items:
+            heap.append((pos[d], -int(it["peso"]), seq, it))
+            seq += 1
+    heapq.heapify(heap)
+
+    # right[i]: dia >= i com vaga (n = nenhum); left[i + 1]: dia <= i com vaga (0 = nenhum)
+    right = [i if free[i] > 0 else i + 1 for i in range(n)] + [n]
+    left = [0] + [i + 1 if free[i] > 0 else i for i in range(n)]
+
+    by_day = OrderedDict((d, []) for d in study_days)
+    deferrals, overflow = [], []
+    while heap:
+        due, _, _, it = heapq.heappop(heap)
+        w_idx = pos.get(it["watched_date"], -1)
+        lo = max(due - tolerance, w_idx + 1)
+        hi = min(due + tolerance, n - 1)
+
+        r = _find_free(right, due)
+        l = _find_free(left, due + 1) - 1
+        choice = None
+        if r <= hi:
+            choice = r
+        if lo <= l and (choice is None or due - l < choice - due):
+            choice = l
+
+        if choice is None:
+            by_day[study_days[due]].append(it)
+            overflow.append(dict(it, due=study_days[due]))
             continue
 
-        # Senão, envia para o PRÓXIMO dia de estudo disponível em ou após t_raw, sem ultrapassar 'last'.
-        d = t_raw
-        while d <= last and d not in study_days_set:
-            d = d + timedelta(days=1)
-        if d in study_days_set:
-            reviews[d].extend(items)
-        # Se não existir um dia de estudo até 'last', a revisão é omitida.
+        by_day[study_days[choice]].append(it)
+        free[choice] -= 1
+        if free[choice] == 0:
+            right[choice] = choice + 1
+            left[choice + 1] = choice
+        if choice != due:
+            deferrals.append({
+                "aula": it["aula"], "modulo": it["modulo"], "peso": it["peso"],
+                "due": study_days[due], "placed": study_days[choice], "shift": choice - due,
+            })
 
-    return reviews
+    return LeveledReviews(by_day, deferrals, overflow)
 
 def next_study_day_on_or_after(target: date, study_days_set):
     d = target
@@ -886,11 +1323,194 @@ def next_study_day_on_or_after(target: date, study_days_set):
 def load_document_with_template(template_path: Optional[str]) -> Document:
     if template_path and os.path.isfile(template_path):
         try:
-            return Document(template_path)
+            return Document(io.BytesIO(read_file_cached(template_path)))
         except Exception:
             return Document()
     return Document()
 
+TEMPLATE_CORE_STYLES = [
+    "Title","Heading 1","Heading 2","Heading 3","Heading 4","Heading 5","Heading 6","Heading 7","Heading 8","Heading 9",
+    "Título","Título 1","Título 2","Título 3","Título 4","Título 5","Título 6","Título 7","Título 8","Título 9"
+]
+
+def merge_template_styles(doc: Document, template_path: str) -> bool:
+    """
+    Equivalente em Python puro ao Word COM (UpdateStylesOnOpen + OrganizerCopy), aplicado em memória antes do save:
+    - estilos do template cujo nome já existe no documento, ou listados em TEMPLATE_CORE_STYLES, são copiados
+      (com as dependências basedOn/link/next ausentes no documento);
+    - os IDs do template (ex.: "Ttulo1" no Word em português) são trocados pelos IDs do documento ("Heading1"),
+      de modo que os parágrafos já estilizados continuam apontando para o estilo certo;
+    - docDefaults e tema do template substituem os do documento;
+    - as listas (abstractNum/num) usadas pelos estilos copiados entram na numeração do documento com IDs
+      novos, sem apagar as listas que o documento já usa (a parte de numeração é criada se faltar).
+    Retorna False se o template não puder ser lido.
+    """
+    import zipfile
+    from copy import deepcopy
+    from lxml import etree
+    from docx.opc.constants import RELATIONSHIP_TYPE as RT
+    from docx.oxml import parse_xml
+    try:
+        zf = zipfile.ZipFile(io.BytesIO(read_file_cached(template_path)))
+        tpl_root = etree.fromstring(zf.read("word/styles.xml"))
+    except Exception:
+        return False
+
+    def _val(el, tag):
+        child = el.find(qn(tag))
+        return child.get(qn("w:val")) if child is not None else None
+
+    dst_root = doc.styles.element
+    dst_by_name = {}
+    dst_by_id = {}
+    for st in dst_root.findall(qn("w:style")):
+        dst_by_id[st.get(qn("w:styleId"))] = st
+        name = _val(st, "w:name")
+        if name:
+            dst_by_name[name.lower()] = st
+
+    tpl_by_id = OrderedDict()
+    for st in tpl_root.findall(qn("w:style")):
+        tpl_by_id[st.get(qn("w:styleId"))] = st
+
+    # Seleção: nomes existentes no documento + estilos principais + dependências ausentes
+    core = {n.lower() for n in TEMPLATE_CORE_STYLES}
+    selected = [sid for sid, st in tpl_by_id.items()
+                if (_val(st, "w:name") or "").lower() in dst_by_name or (_val(st, "w:name") or "").lower() in core]
+    seen = set(selected)
+    i = 0
+    while i < len(selected):
+        st = tpl_by_id[selected[i]]
+        for tag in ("w:basedOn", "w:link", "w:next"):
+            ref = _val(st, tag)
+            if ref and ref in tpl_by_id and ref not in seen:
+                selected.append(ref)
+                seen.add(ref)
+        i += 1
+
+    # IDs do template -> IDs do documento (mesmo nome)
+    remap = {}
+    for sid in selected:
+        d = dst_by_name.get((_val(tpl_by_id[sid], "w:name") or "").lower())
+        if d is not None:
+            remap[sid] = d.get(qn("w:styleId"))
+
+    for sid in selected:
+        new_st = deepcopy(tpl_by_id[sid])
+        new_id = remap.get(sid, sid)
+        new_st.set(qn("w:styleId"), new_id)
+        for tag in ("w:basedOn", "w:link", "w:next"):
+            child = new_st.find(qn(tag))
+            if child is not None and child.get(qn("w:val")) in remap:
+                child.set(qn("w:val"), remap[child.get(qn("w:val"))])
+        old = dst_by_id.get(new_id)
+        if old is not None:
+            # Estilo de caractere vinculado que deixa de ser usado (ex.: "Heading 1 Char" -> "Título 1 Char")
+            old_link = _val(old, "w:link")
+            if old_link and old_link != _val(new_st, "w:link") and old_link in dst_by_id \
+                    and _val(dst_by_id[old_link], "w:link") == new_id and old_link not in remap.values():
+                dst_root.remove(dst_by_id.pop(old_link))
+            old.addprevious(new_st)
+            dst_root.remove(old)
+        else:
+            dst_root.append(new_st)
+        dst_by_id[new_id] = new_st
+
+    tpl_defaults = tpl_root.find(qn("w:docDefaults"))
+    if tpl_defaults is not None:
+        dst_defaults = dst_root.find(qn("w:docDefaults"))
+        if dst_defaults is not None:
+            dst_root.replace(dst_defaults, deepcopy(tpl_defaults))
+        else:
+            dst_root.insert(0, deepcopy(tpl_defaults))
+
+    # Tema do template (estilos podem usar fontes do tema)
+    names = set(zf.namelist())
+    for rel in doc.part.rels.values():
+        if not rel.is_external and rel.reltype == RT.THEME and "word/theme/theme1.xml" in names:
+            rel.target_part._blob = zf.read("word/theme/theme1.xml")
+
+    if "word/numbering.xml" in names:
+        _merge_style_numbering(doc, parse_xml(zf.read("word/numbering.xml")),
+                               [dst_by_id[remap.get(sid, sid)] for sid in selected], remap)
+    return True
+
+def _numbering_element(doc: Document):
+    # w:numbering do documento; cria word/numbering.xml vazio se não houver (o python-docx não cria)
+    from docx.opc.constants import CONTENT_TYPE as CT, RELATIONSHIP_TYPE as RT
+    from docx.opc.packuri import PackURI
+    from docx.oxml import parse_xml
+    from docx.parts.numbering import NumberingPart
+    for rel in doc.part.rels.values():
+        if not rel.is_external and rel.reltype == RT.NUMBERING:
+            return rel.target_part.element
+    part = NumberingPart(PackURI("/word/numbering.xml"), CT.WML_NUMBERING,
+                         parse_xml('<w:numbering xmlns:w="http://schemas.openxmlformats.org/wordprocessingml/2006/main"/>'),
+                         doc.part.package)
+    doc.part.relate_to(part, RT.NUMBERING)
+    return part.element
+
+def _merge_style_numbering(doc: Document, tpl_numbering, styles, style_remap: dict):
+    """
+    Copia da numeração do template só as listas referidas por numPr nos estilos copiados,
+    com abstractNumId/numId novos (acima dos existentes) e os numId dos estilos atualizados.
+    """
+    from copy import deepcopy
+    refs = []
+    for st in styles:
+        for num_id in st.findall("./" + qn("w:pPr") + "/" + qn("w:numPr") + "/" + qn("w:numId")):
+            if num_id.get(qn("w:val")) not in (None, "0"):
+                refs.append(num_id)
+    if not refs:
+        return
+
+    tpl_nums = {n.get(qn("w:numId")): n for n in tpl_numbering.findall(qn("w:num"))}
+    tpl_abstracts = {a.get(qn("w:abstractNumId")): a for a in tpl_numbering.findall(qn("w:abstractNum"))}
+    dst = _numbering_element(doc)
+    next_num = 1 + max([int(n.get(qn("w:numId"))) for n in dst.findall(qn("w:num"))] or [0])
+    next_abs = 1 + max([int(a.get(qn("w:abstractNumId"))) for a in dst.findall(qn("w:abstractNum"))] or [-1])
+
+    num_map, abs_map = {}, {}
+    for ref in refs:
+        old_num = ref.get(qn("w:val"))
+        if old_num not in num_map:
+            num = tpl_nums.get(old_num)
+            abs_ref = num.find(qn("w:abstractNumId")) if num is not None else None
+            old_abs = abs_ref.get(qn("w:val")) if abs_ref is not None else None
+            if old_abs not in tpl_abstracts:
+                num_map[old_num] = None
+                continue
+            if old_abs not in abs_map:
+                abstract = deepcopy(tpl_abstracts[old_abs])
+                abstract.set(qn("w:abstractNumId"), str(next_abs))
+                nsid = abstract.find(qn("w:nsid"))
+                if nsid is not None:
+                    # nsid repetido faz o Word juntar listas diferentes
+                    nsid.set(qn("w:val"), hashlib.sha1(f"gear-{next_abs}-{old_abs}".encode()).hexdigest()[:8].upper())
+                for pstyle in abstract.iter(qn("w:pStyle")):
+                    if pstyle.get(qn("w:val")) in style_remap:
+                        pstyle.set(qn("w:val"), style_remap[pstyle.get(qn("w:val"))])
+                # Esquema: todos os abstractNum antes dos num
+                first_num = dst.find(qn("w:num"))
+                if first_num is not None:
+                    first_num.addprevious(abstract)
+                else:
+                    dst.append(abstract)
+                abs_map[old_abs] = str(next_abs)
+                next_abs += 1
+            new_num = deepcopy(num)
+            new_num.set(qn("w:numId"), str(next_num))
+            new_num.find(qn("w:abstractNumId")).set(qn("w:val"), abs_map[old_abs])
+            last_num = dst.findall(qn("w:num"))
+            if last_num:
+                last_num[-1].addnext(new_num)
+            else:
+                dst.append(new_num)
+            num_map[old_num] = str(next_num)
+            next_num += 1
+        if num_map[old_num] is not None:
+            ref.set(qn("w:val"), num_map[old_num])
+
 def apply_template_styles_win(docx_path: str, template_path: str) -> bool:
     if not (WIN32_AVAILABLE and os.path.isfile(template_path) and os.path.isfile(docx_path)):
         return False
@@ -905,11 +1525,7 @@ def apply_template_styles_win(docx_path: str, template_path: str) -> bool:
         wdOrganizerObjectStyles = 3
         src = os.path.abspath(template_path)
         dst = os.path.abspath(docx_path)
-        core_styles = [
-            "Title","Heading 1","Heading 2","Heading 3","Heading 4","Heading 5","Heading 6","Heading 7","Heading 8","Heading 9",
-            "Título","Título 1","Título 2","Título 3","Título 4","Título 5","Título 6","Título 7","Título 8","Título 9"
-        ]
-        for s in core_styles:
+        for s in TEMPLATE_CORE_STYLES:
             try:
                 word.OrganizerCopy(Source=src, Destination=dst, Name=s, Object=wdOrganizerObjectStyles)
             except Exception:
@@ -926,7 +1542,59 @@ def apply_template_styles_win(docx_path: str, template_path: str) -> bool:
             pass
         return False
 
-def read_inputs_from_gui(prefill: dict):
+class InputPrefetcher:
+    """
+    Carrega os insumos caros (planilhas + índice do catálogo, template, capa, rasters das orientações)
+    em threads de fundo, enquanto o formulário está aberto. update() recebe os caminhos atuais e só
+    dispara de novo o que mudou; wait() aguarda o que ainda estiver em andamento. Os resultados
+    ficam nos caches residentes, que run_generation consulta normalmente.
+    """
+
+    def __init__(self, workers: int = 3, capa_dpi: int = COVER_DPI, orient_vector: bool = False):
+        from concurrent.futures import ThreadPoolExecutor
+        self._pool = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="gear-prefetch")
+        self._capa_dpi = capa_dpi
+        self.orient_vector = orient_vector
+        self._submitted = {}
+        self._futures = {}
+
+    def _submit(self, kind: str, key, fn, *args):
+        if self._submitted.get(kind) == key:
+            return
+        self._submitted[kind] = key
+        self._futures[kind] = self._pool.submit(fn, *args)
+
+    def update(self, temas_path="", aulas_path="", template_path="", capa_path="", orient_path=""):
+        def _ok(path):
+            return bool(path) and os.path.isfile(path)
+
+        try:
+            if _ok(temas_path) and _ok(aulas_path):
+                self._submit("catalogo", (temas_path, aulas_path, _file_key(temas_path), _file_key(aulas_path)),
+                             load_catalog, temas_path, aulas_path)
+            if _ok(template_path):
+                self._submit("template", _file_key(template_path), read_file_cached, template_path)
+            if _ok(capa_path):
+                self._submit("capa", _file_key(capa_path), prepared_cover_bytes, capa_path,
+                             21.0 / 2.54, 29.7 / 2.54, self._capa_dpi)
+            if _ok(orient_path) and orient_path.lower().endswith(".pdf"):
+                self._submit("orientacoes", (_file_key(orient_path), self.orient_vector),
+                             vectorize_pdf_pages if self.orient_vector else rasterize_pdf_pages, orient_path)
+        except OSError:
+            pass
+
+    def wait(self):
+        # Erros na pré-carga são ignorados: a geração repete a carga e mostra o erro real
+        for fut in list(self._futures.values()):
+            try:
+                fut.result()
+            except Exception:
+                pass
+
+    def close(self):
+        self._pool.shutdown(wait=False)
+
+def read_inputs_from_gui(prefill: dict, prefetcher: Optional[InputPrefetcher] = None):
     root = tk.Tk()
     root.title("Gerador de Cronograma – Parâmetros")
 
@@ -948,6 +1616,8 @@ def read_inputs_from_gui(prefill: dict):
     # NOVO: seleção de offsets de revisão
     preselected_offsets = prefill.get("review_offsets", DEFAULT_REVIEW_OFFSETS)
     review_vars = {d: tk.BooleanVar(value=(d in preselected_offsets)) for d in DEFAULT_REVIEW_OFFSETS}
+    leveling_var = tk.BooleanVar(value=bool(prefill.get("review_leveling", False)))
+    vector_var = tk.BooleanVar(value=bool(prefill.get("orientacoes_vetoriais", False)))
 
     def browse_excel(var):
         path = filedialog.askopenfilename(title="Selecione o arquivo Excel", filetypes=[("Excel","*.xlsx")])
@@ -972,8 +1642,51 @@ def read_inputs_from_gui(prefill: dict):
     frm = ttk.Frame(root, padding=10)
     frm.grid(row=0, column=0, sticky="nsew")
 
+    # Pré-carga dos insumos com os caminhos atuais; refeita (com atraso) quando um caminho muda
+    prefetch_after = [None]
+
+    def run_prefetch():
+        prefetch_after[0] = None
+        prefetcher.update(temas_path_var.get(), aulas_path_var.get(), template_path_var.get().strip(),
+                          capa_path_var.get(), orient_path_var.get())
+
+    def schedule_prefetch(*_):
+        if prefetch_after[0] is not None:
+            root.after_cancel(prefetch_after[0])
+        prefetch_after[0] = root.after(500, run_prefetch)
+
+    if prefetcher is not None:
+        for var in (temas_path_var, aulas_path_var, template_path_var, capa_path_var, orient_path_var):
+            var.trace_add("write", schedule_prefetch)
+        run_prefetch()
+
+    def compute_min_minutes():
+        try:
+            params = {
+                "dias_por_semana": int(dias_semana_var.get()),
+                "data_inicio": parse_date_br(data_inicio_var.get()),
+                "data_prova": parse_date_br(data_prova_var.get()),
+                "tipo_prova": tipo_var.get(),
+                "temas_path": temas_path_var.get(),
+                "aulas_path": aulas_path_var.get(),
+                "custom_weekdays": {i for i, v in enumerate(weekday_vars) if v.get()},
+                "review_offsets": sorted([d for d, v in review_vars.items() if v.get()]),
+            }
+            params["feriados"], params["bloqueios"] = parse_calendar_exclusions(prefill)
+            res = solve_min_minutes(params)[0]
+        except Exception as e:
+            messagebox.showerror("Erro", f"Não foi possível calcular: {e}")
+            return
+        if res["minutos_por_dia"] is None:
+            messagebox.showinfo("Minutos mínimos", "Nem 24 h por dia bastam para um Cronograma Completo nesse intervalo.")
+            return
+        minutos_var.set(str(res["minutos_por_dia"]))
+        messagebox.showinfo("Minutos mínimos", f"Cronograma Completo a partir de {res['minutos_por_dia']} minutos por dia "
+                                               f"({res['simulacoes']} simulações).")
+
     ttk.Label(frm, text="Minutos de estudo por dia").grid(row=0, column=0, sticky="w")
     ttk.Entry(frm, textvariable=minutos_var, width=12).grid(row=0, column=1, sticky="w")
+    ttk.Button(frm, text="Calcular mínimo", command=compute_min_minutes).grid(row=0, column=2, sticky="w")
 
     ttk.Label(frm, text="Dias de estudo por semana").grid(row=1, column=0, sticky="w")
     ttk.Entry(frm, textvariable=dias_semana_var, width=12).grid(row=1, column=1, sticky="w")
@@ -1005,6 +1718,14 @@ def read_inputs_from_gui(prefill: dict):
     ttk.Entry(frm, textvariable=orient_path_var, width=48).grid(row=9, column=1, sticky="w")
     ttk.Button(frm, text="Procurar", command=lambda: browse_orient(orient_path_var)).grid(row=9, column=2, sticky="w")
 
+    def on_vector_toggle(*_):
+        if prefetcher is not None:
+            prefetcher.orient_vector = vector_var.get()
+            schedule_prefetch()
+
+    ttk.Checkbutton(frm, text="Orientações em PDF como vetor (SVG): DOCX menor e texto nítido",
+                    variable=vector_var, command=on_vector_toggle).grid(row=9, column=3, sticky="w")
+
     ttk.Label(frm, text="Arquivo de estilos (.dotx)").grid(row=10, column=0, sticky="w")
     ttk.Entry(frm, textvariable=template_path_var, width=48).grid(row=10, column=1, sticky="w")
     ttk.Button(frm, text="Procurar", command=lambda: browse_dotx(template_path_var)).grid(row=10, column=2, sticky="w")
@@ -1036,6 +1757,32 @@ def read_inputs_from_gui(prefill: dict):
     # exibição horizontal: 1, 3, 7, 14, 30
     for col, d in enumerate(DEFAULT_REVIEW_OFFSETS, start=0):
         ttk.Checkbutton(review_frame, text=str(d), variable=review_vars[d]).grid(row=1, column=col, sticky="w")
+    ttk.Checkbutton(review_frame, text="Limitar revisões à cota diária (redistribui o excedente)",
+                    variable=leveling_var).grid(row=2, column=0, columnspan=len(DEFAULT_REVIEW_OFFSETS), sticky="w", pady=(4,0))
+
+    def preview():
+        try:
+            params = {
+                "minutos_por_dia": int(minutos_var.get()),
+                "dias_por_semana": int(dias_semana_var.get()),
+                "data_inicio": parse_date_br(data_inicio_var.get()),
+                "data_prova": parse_date_br(data_prova_var.get()),
+                "tipo_prova": tipo_var.get(),
+                "temas_path": temas_path_var.get(),
+                "aulas_path": aulas_path_var.get(),
+                "template_path": template_path_var.get().strip(),
+                "custom_weekdays": {i for i, v in enumerate(weekday_vars) if v.get()},
+                "review_offsets": sorted([d for d, v in review_vars.items() if v.get()]),
+                "review_leveling": leveling_var.get(),
+            }
+            params["feriados"], params["bloqueios"] = parse_calendar_exclusions(prefill)
+            res = run_preview(params, out_dir=os.path.join(tempfile.gettempdir(), "gear_previa"))
+        except Exception as e:
+            messagebox.showerror("Erro", f"Não foi possível gerar a prévia: {e}")
+            return
+        status = "Completo" if res["completo"] else f"Abreviado ({res['removed_count']} aulas removidas)"
+        if not open_file(res["docx"]):
+            messagebox.showinfo("Prévia", f"Cronograma {status}, {res['total_weeks']} semanas.\nPrévia: {res['docx']}")
 
     def on_ok():
         try:
@@ -1073,14 +1820,17 @@ def read_inputs_from_gui(prefill: dict):
                 "orient_path": orient_path_var.get(),
                 "template_path": template_path_var.get().strip(),
                 "custom_weekdays": {i for i, v in enumerate(weekday_vars) if v.get()},
-                "review_offsets": selected_offsets
+                "review_offsets": selected_offsets,
+                "review_leveling": leveling_var.get(),
+                "orient_vector": vector_var.get()
             }
             root.destroy()
         except Exception as e:
             messagebox.showerror("Erro", f"Entrada inválida: {e}")
 
     ttk.Button(frm, text="Gerar", command=on_ok).grid(row=14, column=0, pady=(12,0))
-    ttk.Button(frm, text="Cancelar", command=root.destroy).grid(row=14, column=1, pady=(12,0))
+    ttk.Button(frm, text="Pré-visualizar", command=preview).grid(row=14, column=1, pady=(12,0))
+    ttk.Button(frm, text="Cancelar", command=root.destroy).grid(row=14, column=2, pady=(12,0))
 
     root.mainloop()
     if hasattr(root, "result"):
@@ -1105,65 +1855,198 @@ def read_dataframes(temas_path, aulas_path):
     aulas["Duração"] = aulas["Duração"].astype(int)
     return temas, aulas
 
-def build_lessons_queue(temas_df, aulas_df, tipo_prova):
-    # 1) Calcula pesos por tipo de prova e elimina módulos com peso 0
-    temas_df = temas_df.copy()
-    temas_df["peso"] = temas_df[tipo_prova].astype(int)
-    temas_valid = temas_df[temas_df["peso"] > 0].copy()
-
-    # 2) Custo total por módulo (só para relatórios e desempate na remoção)
-    custos = (
-        aulas_df.groupby("Nome do Tema")["Duração"]
-        .sum()
-        .reset_index()
-        .rename(columns={"Duração": "custo"})
-    )
-    temas_valid = temas_valid.merge(custos, on="Nome do Tema", how="left").fillna({"custo": 0})
-
-    # 3) Mapas de apoio
-    peso_map = dict(zip(temas_valid["Nome do Tema"], temas_valid["peso"]))
-    custo_map = dict(zip(temas_valid["Nome do Tema"], temas_valid["custo"]))
-
-    # 4) Fila de aulas NA ORDEM DO EXCEL, limitada aos módulos com peso > 0
-    mod_valid_set = set(temas_valid["Nome do Tema"])
-    aulas_filtradas = aulas_df[aulas_df["Nome do Tema"].isin(mod_valid_set)]
-
-    lessons = []
-    for _, row in aulas_filtradas.iterrows():
-        modulo = str(row["Nome do Tema"])
-        lessons.append({
-            "aula": str(row["Nome da Aula"]),
-            "modulo": modulo,
-            "dur": int(row["Duração"]),
-            "peso": int(peso_map.get(modulo, 0)),
-        })
-
-    # 5) Apenas para exibição/relatório: módulos hierarquizados por peso (não afeta a alocação)
-    mod_order = (
-        temas_valid.sort_values(by=["peso", "custo"], ascending=[False, True])["Nome do Tema"].tolist()
-    )
+# Índices de catálogo já calculados, por versão de conteúdo das planilhas
+_CATALOG_INDEX_CACHE = {}
+
+def catalog_version(temas_df, aulas_df) -> str:
+    # Hash do conteúdo (colunas + valores) das duas planilhas
+    h = hashlib.sha1()
+    for df in (temas_df, aulas_df):
+        h.update("|".join(str(c) for c in df.columns).encode("utf-8"))
+        h.update(pd.util.hash_pandas_object(df, index=False).values.tobytes())
+    return h.hexdigest()
+
+def _tipo_fingerprint(entry: dict) -> str:
+    # Conteúdo que um tipo de prova consome do catálogo: fila de aulas (com pesos) e módulos válidos
+    h = hashlib.sha1()
+    h.update(json.dumps([[l["modulo"], l["aula"], l["dur"], l["peso"]] for l in entry["lessons"]],
+                        ensure_ascii=False).encode("utf-8"))
+    h.update(json.dumps(sorted(entry["peso_map"].items()), ensure_ascii=False).encode("utf-8"))
+    return h.hexdigest()
+
+def build_catalog_index(temas_df, aulas_df, previous: Optional[dict] = None):
+    """
+    Pré-calcula, em uma única passada, pesos, máscaras de módulos válidos, custos e
+    filas de aulas para TODOS os tipos de prova. Reutilizado enquanto o conteúdo
+    das planilhas não mudar (chave = catalog_version).
+    Cada tipo leva uma impressão digital ("fingerprint"); com previous (índice anterior), tipos cujo
+    conteúdo não mudou reaproveitam a MESMA entrada, e os caches derivados deles continuam válidos.
+    """
+    version = catalog_version(temas_df, aulas_df)
+    cached = _CATALOG_INDEX_CACHE.get(version)
+    if cached is not None:
+        return cached
+
+    nomes = temas_df["Nome do Tema"].tolist()
+    pesos = temas_df[TIPOS_PROVA].astype(int)
+    custos_all = aulas_df.groupby("Nome do Tema")["Duração"].sum().to_dict()
+
+    # Aulas na ORDEM DO EXCEL (sem peso; o peso depende do tipo de prova)
+    aulas_mod = aulas_df["Nome do Tema"]
+    base_lessons = [
+        {"aula": str(a), "modulo": str(m), "dur": int(dur)}
+        for a, m, dur in zip(aulas_df["Nome da Aula"], aulas_mod, aulas_df["Duração"])
+    ]
+
+    tipos = {}
+    for tipo in TIPOS_PROVA:
+        col = pesos[tipo].tolist()
+        valid = [(m, w) for m, w in zip(nomes, col) if w > 0]
+        peso_map = {m: int(w) for m, w in valid}
+        custo_map = {m: custos_all.get(m, 0) for m, _ in valid}
+        lesson_mask = aulas_mod.isin(set(peso_map)).tolist()
+        lessons = [
+            dict(l, peso=int(peso_map.get(l["modulo"], 0)))
+            for l, keep in zip(base_lessons, lesson_mask) if keep
+        ]
+        # Apenas para exibição/relatório: módulos hierarquizados por peso (não afeta a alocação)
+        mod_order = [m for m, _ in sorted(valid, key=lambda mw: (-mw[1], custo_map[mw[0]]))]
+        entry = {
+            "lessons": lessons,
+            "peso_map": peso_map,
+            "custo_map": custo_map,
+            "mod_order": mod_order,
+        }
+        entry["fingerprint"] = _tipo_fingerprint(entry)
+        old = (previous or {}).get("tipos", {}).get(tipo)
+        tipos[tipo] = old if old is not None and old["fingerprint"] == entry["fingerprint"] else entry
+
+    index = {"version": version, "tipos": tipos}
+    _CATALOG_INDEX_CACHE[version] = index
+    return index
+
+def build_lessons_queue(temas_df, aulas_df, tipo_prova, catalog_index=None):
+    # Consulta O(1) no índice do catálogo; cópias (inclusive de cada aula) para que o chamador possa
+    # alterá-las sem corromper o índice residente nem os planos já calculados
+    index = catalog_index if catalog_index is not None else build_catalog_index(temas_df, aulas_df)
+    entry = index["tipos"][tipo_prova]
+    return [dict(l) for l in entry["lessons"]], dict(entry["peso_map"]), dict(entry["custo_map"]), list(entry["mod_order"])
+# Intervalo (s) entre verificações das planilhas pelo observador do catálogo
+CATALOG_WATCH_INTERVAL = 2.0
+
+class CatalogStore:
+    """
+    Catálogo residente (planilhas + índice) por par de caminhos, versionado pelo hash do conteúdo.
+    - get() confere data/tamanho dos arquivos; se mudaram e o conteúdo (sha1) também, relê e troca
+      a versão de uma vez (quem já pegou a anterior continua com ela). Mesmo conteúdo: não relê.
+    - Falha ao reler (arquivo ainda sendo salvo) mantém a versão anterior e tenta de novo depois.
+    - Na troca, avisa os ouvintes com (índice antigo, índice novo, tipos de prova alterados), para
+      invalidar só os caches derivados desses tipos.
+    - watch() inicia uma thread que verifica os arquivos já carregados a cada intervalo.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._current = {}
+        self._listeners = []
+        self._watcher = None
+
+    def add_listener(self, callback):
+        self._listeners.append(callback)
+
+    def get(self, temas_path: str, aulas_path: str):
+        key = (os.path.abspath(temas_path), os.path.abspath(aulas_path))
+        stat = (_file_key(temas_path), _file_key(aulas_path))
+        cur = self._current.get(key)
+        if cur is not None and cur["stat"] == stat:
+            return cur["data"]
+        with self._lock:
+            cur = self._current.get(key)
+            if cur is not None and cur["stat"] == stat:
+                return cur["data"]
+            return self._reload(key, stat, cur)["data"]
+
+    def _reload(self, key, stat, cur):
+        def _sha1(path):
+            with open(path, "rb") as f:
+                return hashlib.sha1(f.read()).hexdigest()
+
+        try:
+            digest = (_sha1(key[0]), _sha1(key[1]))
+            if cur is not None and cur["hash"] == digest:
+                new = dict(cur, stat=stat)
+                self._current[key] = new
+                return new
+            temas_df, aulas_df = read_dataframes(*key)
+            old_index = cur["data"][2] if cur is not None else None
+            index = build_catalog_index(temas_df, aulas_df, previous=old_index)
+        except Exception:
+            if cur is None:
+                raise
+            traceback.print_exc()
+            return cur
+
+        new = {"stat": stat, "hash": digest, "data": (temas_df, aulas_df, index)}
+        self._current[key] = new
+        if old_index is not None and old_index["version"] != index["version"]:
+            changed = {t for t, e in old_index["tipos"].items() if index["tipos"].get(t) is not e}
+            if not any(v["data"][2]["version"] == old_index["version"] for v in self._current.values()):
+                _CATALOG_INDEX_CACHE.pop(old_index["version"], None)
+            for cb in list(self._listeners):
+                try:
+                    cb(old_index, index, changed)
+                except Exception:
+                    traceback.print_exc()
+        return new
+
+    def refresh(self):
+        # Verifica todos os catálogos carregados (usado pelo observador)
+        for key in list(self._current):
+            try:
+                self.get(*key)
+            except Exception:
+                traceback.print_exc()
+
+    def watch(self, interval: float = CATALOG_WATCH_INTERVAL):
+        if self._watcher is None:
+            def _loop():
+                while True:
+                    time.sleep(interval)
+                    self.refresh()
+            self._watcher = threading.Thread(target=_loop, name="gear-catalogo", daemon=True)
+            self._watcher.start()
+        return self._watcher
+
+CATALOG = CatalogStore()
+
+def load_catalog(temas_path, aulas_path):
+    # Planilhas + índice do catálogo mantidos residentes; recarregados quando o conteúdo muda
+    return CATALOG.get(temas_path, aulas_path)
 
-    return lessons, peso_map, custo_map, mod_order
 # --- AJUSTAR a assinatura do simulador e usar offsets escolhidos pelo usuário ---
-def simulate_schedule(study_days, minutos_dia, lessons_all, peso_map, review_offsets):
+def simulate_schedule(study_days, minutos_dia, lessons_all, peso_map, review_offsets,
+                      phase_offset: int = 0, phase_total_days: Optional[int] = None, stats: Optional[dict] = None):
+    # phase_offset/phase_total_days: simula apenas o trecho final de um calendário maior (replanejamento),
+    # mantendo as fases relativas ao calendário completo
+    # stats: se informado, recebe os totais desta simulação (aulas forçadas, force_debt, empréstimos de Q/R)
     from collections import defaultdict, OrderedDict
     study_days_set = set(study_days)
-    total_days = len(study_days)
+    total_days = phase_total_days if phase_total_days is not None else len(study_days)
 
     daily = OrderedDict()
-    for d in study_days:
+    for i, d in enumerate(study_days):
         daily[d] = {"A_lessons": [], "Q_min": 0, "R_min": 0,
-                    "phase": determine_phase(study_days.index(d), total_days)}
+                    "phase": determine_phase(phase_offset + i, total_days)}
 
-    reviews_raw = defaultdict(list)
     queue = list(lessons_all)
 
     must_force_carryover = False
+    totals = {"forcadas": 0, "force_debt": 0.0, "emprestado_Q": 0.0, "emprestado_R": 0.0}
 
     for idx, d in enumerate(study_days):
         phase = daily[d]["phase"]
 
-        if idx == 0:
+        if idx + phase_offset == 0:
             fr = {"A": 0.80, "Q": 0.20, "R": 0.00}
         else:
             fr = FRACTIONS_BY_PHASE[phase]
@@ -1203,18 +2086,10 @@ def simulate_schedule(study_days, minutos_dia, lessons_all, peso_map, review_off
 
             if remain > 1e-6:
                 force_debt += remain
+            totals["forcadas"] += 1
 
             daily[d]["A_lessons"].append(lesson)
 
-            for off in review_offsets:
-                t_raw = d + timedelta(days=off)
-                reviews_raw[t_raw].append({
-                    "aula": lesson["aula"],
-                    "modulo": lesson["modulo"],
-                    "watched_date": d,
-                    "peso": int(peso_map.get(lesson["modulo"], 0))
-                })
-
             must_force_carryover = False
 
         if must_force_carryover:
@@ -1240,15 +2115,6 @@ def simulate_schedule(study_days, minutos_dia, lessons_all, peso_map, review_off
 
                 lesson = queue.pop(0)
                 daily[d]["A_lessons"].append(lesson)
-
-                for off in review_offsets:
-                    t_raw = d + timedelta(days=off)
-                    reviews_raw[t_raw].append({
-                        "aula": lesson["aula"],
-                        "modulo": lesson["modulo"],
-                        "watched_date": d,
-                        "peso": int(peso_map.get(lesson["modulo"], 0))
-                    })
             else:
                 must_force_carryover = True
                 break
@@ -1268,13 +2134,80 @@ def simulate_schedule(study_days, minutos_dia, lessons_all, peso_map, review_off
         daily[d]["Q_min"] = Q_final
         daily[d]["R_min"] = R_final
 
+        totals["force_debt"] += force_debt
+        totals["emprestado_Q"] += borrowed_Q
+        totals["emprestado_R"] += borrowed_R
+
+    if stats is not None:
+        stats.update(totals)
     all_allocated = (len(queue) == 0)
-    reviews = normalize_reviews(reviews_raw, study_days)
+    # Revisões derivadas da alocação + offsets, materializadas apenas quando consultadas
+    reviews = LazyReviews(daily, study_days, review_offsets, peso_map)
     return all_allocated, daily, reviews, queue
 
 
-def try_fit_with_removals(study_days, minutos_dia, lessons_all, peso_map, custo_map, review_offsets):
-    ok, daily, reviews, remaining = simulate_schedule(study_days, minutos_dia, lessons_all, peso_map, review_offsets)
+# Rodadas de ajuste da capacidade quando o modelo do calendário se mostra otimista
+KNAPSACK_MAX_ROUNDS = 4
+
+def calendar_capacity(study_days, minutos_dia, phase_offset: int = 0, phase_total_days: Optional[int] = None) -> float:
+    # Minutos de aula que cabem no calendário: cota A + empréstimos máximos de Q e R, dia a dia
+    total_days = phase_total_days if phase_total_days is not None else len(study_days)
+    cap = 0.0
+    for i in range(len(study_days)):
+        idx = phase_offset + i
+        phase = determine_phase(idx, total_days)
+        fr = {"A": 0.80, "Q": 0.20, "R": 0.00} if idx == 0 else FRACTIONS_BY_PHASE[phase]
+        cap += minutos_dia * (fr["A"] + fr["Q"] * BORROW_Q_BY_PHASE[phase] + fr["R"] * BORROW_R)
+    return cap
+
+def knapsack_modules(mod_info: dict, capacity: float) -> set:
+    """
+    Mochila 0/1 por programação dinâmica sobre minutos: escolhe os módulos mantidos que
+    maximizam o peso total sem exceder 'capacity'. Empate: mantém mais minutos de aula.
+    mod_info: {modulo: {"peso": int, "custo": minutos}}.
+    """
+    import numpy as np
+    cap = int(capacity)
+    if cap <= 0:
+        return set()
+    names = list(mod_info)
+    weights = [int(math.ceil(mod_info[m]["custo"])) for m in names]
+    best = np.zeros(cap + 1, dtype=np.int64)
+    take = []
+    for m, w in zip(names, weights):
+        if w > cap:
+            take.append(None)
+            continue
+        # Peso domina; minutos mantidos desempatam
+        v = int(mod_info[m]["peso"]) * (cap + 1) + w
+        cand = best[:cap + 1 - w] + v
+        better = cand > best[w:]
+        row = np.zeros(cap + 1, dtype=bool)
+        row[w:] = better
+        best[w:] = np.where(better, cand, best[w:])
+        take.append(row)
+
+    kept = set()
+    c = cap
+    for i in range(len(names) - 1, -1, -1):
+        row = take[i]
+        if row is not None and row[c]:
+            kept.add(names[i])
+            c -= weights[i]
+    return kept
+
+def try_fit_with_removals(study_days, minutos_dia, lessons_all, peso_map, custo_map, review_offsets,
+                          phase_offset: int = 0, phase_total_days: Optional[int] = None, stats: Optional[dict] = None):
+    # stats: recebe "simulacoes" (total da busca) e os totais da simulação escolhida (ver simulate_schedule)
+    stats = stats if stats is not None else {}
+    stats["simulacoes"] = 0
+
+    def _simulate(lessons):
+        stats["simulacoes"] += 1
+        return simulate_schedule(study_days, minutos_dia, lessons, peso_map, review_offsets,
+                                 phase_offset, phase_total_days, stats=stats)
+
+    ok, daily, reviews, remaining = _simulate(lessons_all)
     if ok:
         return True, daily, reviews, []
 
@@ -1284,14 +2217,28 @@ def try_fit_with_removals(study_days, minutos_dia, lessons_all, peso_map, custo_
         mod_info.setdefault(m, {"peso": peso_map.get(m,0), "custo":0})
         mod_info[m]["custo"] += lesson["dur"]
 
-    mods_sorted = sorted(mod_info.items(), key=lambda kv: (kv[1]["peso"], -kv[1]["custo"]))
-    removed_modules = []
+    # 1) Mochila sobre a capacidade do calendário; confirmação com UMA simulação.
+    #    Se ainda sobrar fila, desconta o excedente da capacidade e refaz a escolha.
+    capacity = calendar_capacity(study_days, minutos_dia, phase_offset, phase_total_days)
+    kept = set(mod_info)
+    for _ in range(KNAPSACK_MAX_ROUNDS):
+        kept = knapsack_modules(mod_info, capacity)
+        working_lessons = [l for l in lessons_all if l["modulo"] in kept]
+        ok, daily, reviews, remaining = _simulate(working_lessons)
+        if ok:
+            removed_lessons = [l for l in lessons_all if l["modulo"] not in kept]
+            return True, daily, reviews, removed_lessons
+        capacity -= max(1.0, float(sum(l["dur"] for l in remaining)))
+
+    # 2) Contingência: remoção gulosa (menor peso; empate maior carga horária) a partir da última escolha
+    removed_modules = [m for m in mod_info if m not in kept]
+    mods_sorted = sorted(((m, mod_info[m]) for m in kept), key=lambda kv: (kv[1]["peso"], -kv[1]["custo"]))
 
-    working_lessons = list(lessons_all)
+    working_lessons = [l for l in lessons_all if l["modulo"] in kept]
     for m, meta in mods_sorted:
         working_lessons = [l for l in working_lessons if l["modulo"] != m]
         removed_modules.append(m)
-        ok, daily, reviews, remaining = simulate_schedule(study_days, minutos_dia, working_lessons, peso_map, review_offsets)
+        ok, daily, reviews, remaining = _simulate(working_lessons)
         if ok:
             removed_lessons = [l for l in lessons_all if l["modulo"] in removed_modules]
             return True, daily, reviews, removed_lessons
@@ -1308,7 +2255,7 @@ def ensure_a4(doc: Document):
         section.top_margin = Cm(2.0)
         section.bottom_margin = Cm(2.0)
 
-def add_cover(doc, capa_path: str):
+def add_cover(doc, capa_path: str, dpi: int = COVER_DPI):
     # 1) Zera margens da PRIMEIRA seção para permitir full-bleed
     sec0 = doc.sections[0]
     orig = {
@@ -1334,7 +2281,7 @@ def add_cover(doc, capa_path: str):
     p.alignment = WD_ALIGN_PARAGRAPH.CENTER
     run = p.add_run()
     run.add_picture(
-        capa_path,
+        io.BytesIO(prepared_cover_bytes(capa_path, orig["page_width"].inches, orig["page_height"].inches, dpi)),
         width=orig["page_width"],
         height=orig["page_height"]
     )
@@ -1452,6 +2399,15 @@ def iter_weeks(study_days):
     if buf:
         yield current_week, buf
 
+def watched_label(d: date, watched_date: date) -> str:
+    # calcula "há X dias" com singular/plural e caso "hoje"
+    days_ago = (d - watched_date).days
+    if days_ago <= 0:
+        return "hoje"
+    if days_ago == 1:
+        return "há 1 dia"
+    return f"há {days_ago} dias"
+
 # AJUSTE: adicionar parâmetro label_dates para controlar exibição de datas nos dias de estudo
 def add_schedule(doc: Document, study_days, daily, reviews, peso_map, label_dates: bool):
     for wstart, days in iter_weeks(study_days):
@@ -1516,15 +2472,7 @@ def add_schedule(doc: Document, study_days, daily, reviews, peso_map, label_date
             todays_reviews = sorted(reviews.get(d, []), key=lambda x: (-x["peso"], x["modulo"], x["aula"]))
             if todays_reviews:
                 for item in todays_reviews:
-                    # calcula "há X dias" com singular/plural e caso "hoje"
-                    days_ago = (d - item["watched_date"]).days
-                    if days_ago <= 0:
-                        quando = "hoje"
-                    elif days_ago == 1:
-                        quando = "há 1 dia"
-                    else:
-                        quando = f"há {days_ago} dias"
-                    doc.add_paragraph(f"{item['aula']} (Assistida {quando}).")
+                    doc.add_paragraph(f"{item['aula']} (Assistida {watched_label(d, item['watched_date'])}).")
             else:
                 doc.add_paragraph("Sem itens de revisão programados para hoje.")
             doc.add_paragraph("")
@@ -1532,6 +2480,327 @@ def add_schedule(doc: Document, study_days, daily, reviews, peso_map, label_date
 
         doc.add_page_break()
 
+# --- RENDERIZAÇÃO PARALELA DO CRONOGRAMA SEMANAL ---
+
+# Abaixo disso a partida do pool (no Windows, cada processo reimporta este módulo) custa mais que renderizar em série
+PARALLEL_MIN_WEEKS = 16
+# Menor bloco enviado a um processo; limita os processos a ceil(semanas / bloco)
+PARALLEL_MIN_CHUNK_WEEKS = 4
+
+def _render_schedule_chunk(template_path, study_days, daily, reviews, peso_map, label_dates):
+    # Executado em processo separado: renderiza as semanas do bloco e devolve o XML do corpo
+    from lxml import etree
+    doc = load_document_with_template(template_path)
+    body = doc.element.body
+    n_before = len([c for c in body.iterchildren() if c.tag != qn("w:sectPr")])
+    add_schedule(doc, study_days, daily, reviews, peso_map, label_dates)
+    new_children = [c for c in body.iterchildren() if c.tag != qn("w:sectPr")][n_before:]
+    return [etree.tostring(c, encoding="unicode") for c in new_children]
+
+def add_schedule_parallel(doc: Document, template_path, study_days, daily, reviews, peso_map, label_dates: bool,
+                          workers: Optional[int] = None, chunk_weeks: Optional[int] = None):
+    """
+    Igual a add_schedule, mas divide as semanas em blocos renderizados em processos paralelos.
+    Os fragmentos XML são anexados NA ORDEM ao corpo do documento final (antes do sectPr).
+    Os blocos partem do mesmo template, portanto os IDs de estilo coincidem; a numeração
+    "Dia N" reinicia a cada semana e os blocos respeitam os limites de semana.
+    Cai para a versão serial com poucos núcleos, poucas semanas ou em caso de falha.
+    """
+    workers = workers or os.cpu_count() or 1
+    weeks = [days for _, days in iter_weeks(study_days)]
+    # ~2 blocos por processo para equilibrar a carga, sem blocos menores que PARALLEL_MIN_CHUNK_WEEKS
+    chunk_weeks = chunk_weeks or max(PARALLEL_MIN_CHUNK_WEEKS, math.ceil(len(weeks) / (workers * 2)))
+    workers = min(workers, math.ceil(len(weeks) / chunk_weeks))
+    if workers <= 1 or len(weeks) < PARALLEL_MIN_WEEKS:
+        add_schedule(doc, study_days, daily, reviews, peso_map, label_dates)
+        return
+
+    jobs = []
+    for i in range(0, len(weeks), chunk_weeks):
+        days = [d for w in weeks[i:i + chunk_weeks] for d in w]
+        jobs.append((
+            template_path,
+            days,
+            OrderedDict((d, daily[d]) for d in days),
+            {d: reviews.get(d, []) for d in days},
+            peso_map,
+            label_dates,
+        ))
+
+    try:
+        from concurrent.futures import ProcessPoolExecutor
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            fragments = list(pool.map(_render_schedule_chunk, *zip(*jobs)))
+    except Exception:
+        add_schedule(doc, study_days, daily, reviews, peso_map, label_dates)
+        return
+
+    from docx.oxml import parse_xml
+    body = doc.element.body
+    sect_pr = body.find(qn("w:sectPr"))
+    for chunk in fragments:
+        for xml in chunk:
+            el = parse_xml(xml)
+            if sect_pr is not None:
+                sect_pr.addprevious(el)
+            else:
+                body.append(el)
+
+# --- RENDERIZAÇÃO HTML (visualização no navegador, sem DOCX) ---
+
+# Seletores sob .cronograma para poder embutir os blocos em outra página (gear_app.py)
+HTML_STYLE = """
+.cronograma { background: #000; color: #eee; font-family: Calibri, Arial, sans-serif; padding: 0 1em; }
+.cronograma h1 { color: #d9bb26; border-bottom: 1px solid #444; }
+.cronograma h2 { color: #fff; margin-bottom: .2em; }
+.cronograma h3 { color: #ccc; font-size: 1em; margin: .8em 0 .2em; }
+.cronograma p { margin: .1em 0; }
+.cronograma .aula::before { content: "➙ "; color: #d9bb26; font-weight: bold; }
+"""
+
+def contracapa_html(tipo_prova, di, dp, min_dia, dps, total_weeks, total_A_min, total_QR_min, completo: bool, removed_count) -> str:
+    # Mesmo conteúdo de add_contracapa
+    esc = html.escape
+    rows = [
+        ("Data de início", format_date_br(di)),
+        ("Data da prova", format_date_br(dp)),
+        ("Minutos de estudo por dia", min_dia),
+        ("Dias de estudo por semana", dps),
+        ("Duração total do cronograma em semanas", total_weeks),
+        ("Tempo total de aulas programadas", f"{total_A_min} minutos"),
+        ("Tempo total de questões + revisão", f"{total_QR_min} minutos"),
+    ]
+    out = [f"<section class='contracapa'><h1>Tipo de prova: {esc(str(tipo_prova))}</h1>",
+           "<h3>Especificações Personalizadas</h3>"]
+    out.extend(f"<p><b>{esc(label)}:</b> {esc(str(value))}</p>" for label, value in rows)
+    out.append("<h3>Tipo de Cronograma</h3>")
+    if completo:
+        out.append("<p>Cronograma Completo.</p>")
+    else:
+        out.append("<p>Cronograma Abreviado.</p>")
+        out.append(f"<p><b>Nota:</b> {removed_count} aulas foram removidas por limitação de capacidade. A lista detalhada "
+                   "consta ao final do documento; é facultado ao aluno realizar substituições manuais conforme domínio "
+                   "individual dos temas.</p>")
+    out.append("</section>")
+    return "".join(out)
+
+def iter_schedule_html(study_days, daily, reviews, label_dates: bool):
+    """Gera o HTML de add_schedule semana a semana (um bloco <section> por semana)."""
+    esc = html.escape
+    for wstart, days in iter_weeks(study_days):
+        wend = wstart + timedelta(days=6)
+        out = [f"<section class='semana'><h1>Semana {format_date_br(wstart)} a {format_date_br(wend)}</h1>"]
+        for dia_count, d in enumerate(days, start=1):
+            node = daily[d]
+            if label_dates:
+                out.append(f"<h2>Dia {dia_count} - {esc(format_day_with_name(d))}</h2>")
+            else:
+                out.append(f"<h2>Dia de estudo {dia_count}</h2>")
+                out.append("<p>Cronograma finalizado. Você pode alocar esse tempo para assistir aulas recém lançadas "
+                           "na plataforma ou expandir sua revisão.</p>")
+
+            aulas = node["A_lessons"]
+            out.append("<h3>Aulas para Assistir&nbsp;&nbsp;&nbsp;({} min)</h3>".format(sum(l["dur"] for l in aulas)))
+            out.extend("<p class='aula'>{} - {} min</p>".format(esc(str(l["aula"])), l["dur"]) for l in aulas)
+
+            out.append("<h3>Treinamento de Questões&nbsp;&nbsp;&nbsp;({} min)</h3>".format(node["Q_min"]))
+            out.append("<p>Resolução de exercícios referentes às aulas do dia.</p>")
+
+            out.append("<h3>Revisão Espaçada&nbsp;&nbsp;&nbsp;({} min)</h3>".format(node["R_min"]))
+            todays_reviews = sorted(reviews.get(d, []), key=lambda x: (-x["peso"], x["modulo"], x["aula"]))
+            if todays_reviews:
+                out.extend("<p>{} (Assistida {}).</p>".format(esc(str(item["aula"])), watched_label(d, item["watched_date"]))
+                           for item in todays_reviews)
+            else:
+                out.append("<p>Sem itens de revisão programados para hoje.</p>")
+        out.append("</section>")
+        yield "".join(out)
+
+def iter_plan_html(params: dict, plan: dict, weeks: Optional[int] = None, standalone: bool = True):
+    """
+    HTML do cronograma em blocos (contracapa, cada semana, checklist de removidos), direto de daily/reviews.
+    weeks limita às primeiras semanas; standalone=False omite <html>/<head> para embutir em outra página.
+    """
+    study_days = plan["study_days"] if weeks is None else first_weeks(plan["study_days"], weeks)
+    if standalone:
+        yield (f"<!DOCTYPE html><html lang='pt-BR'><head><meta charset='utf-8'><style>{HTML_STYLE}</style></head>"
+               "<body style='background:#000;margin:2em auto;max-width:52em'><div class='cronograma'>")
+    yield contracapa_html(params["tipo_prova"], params["data_inicio"], params["data_prova"],
+                          params["minutos_por_dia"], params["dias_por_semana"], plan["total_weeks"],
+                          plan["total_A_min"], plan["total_QR_min"], plan["completo"], len(plan["removed_lessons"]))
+    yield from iter_schedule_html(study_days, plan["daily"], plan["reviews"], plan["label_dates"])
+    if not plan["completo"] and plan["removed_lessons"] and weeks is None:
+        by_mod = defaultdict(list)
+        for l in plan["removed_lessons"]:
+            by_mod[l["modulo"]].append(l)
+        out = ["<section class='removidos'><h1>Checklist de módulos removidos</h1>"]
+        for m in sorted(by_mod.keys()):
+            out.append(f"<h3>{html.escape(str(m))}</h3>")
+            out.extend("<p> - {} ({} min)</p>".format(html.escape(str(l["aula"])), l["dur"]) for l in by_mod[m])
+        out.append("</section>")
+        yield "".join(out)
+    if standalone:
+        yield "</div></body></html>"
+
+def write_html(params: dict, plan: dict, out_html: str, weeks: Optional[int] = None) -> str:
+    with open(out_html, "w", encoding="utf-8") as f:
+        for chunk in iter_plan_html(params, plan, weeks):
+            f.write(chunk)
+    return out_html
+
+# --- EXPORTAÇÕES PARA SISTEMAS (JSON Lines, Parquet, iCalendar) ---
+
+EXPORT_FORMATS = ("jsonl", "parquet", "ics")
+
+def iter_plan_records(plan: dict, aluno: Optional[str] = None):
+    """
+    Registros planos do cronograma, dia a dia, direto de daily/reviews:
+      {"tipo": "dia", "data", "fase", "aulas_min", "Q_min", "R_min"}
+      {"tipo": "aula", "data", "ordem", "modulo", "aula", "dur"}
+      {"tipo": "revisao", "data", "ordem", "modulo", "aula", "assistida_em", "dias_desde", "offset"}
+    dias_desde é o intervalo real (pode passar do offset quando a revisão rola para o próximo dia de estudo).
+    Datas em ISO (AAAA-MM-DD). aluno, se informado, entra em todos os registros.
+    """
+    base = {"aluno": aluno} if aluno is not None else {}
+    reviews = plan["reviews"]
+    for d in plan["study_days"]:
+        node = plan["daily"][d]
+        iso = d.isoformat()
+        yield dict(base, tipo="dia", data=iso, fase=node.get("phase"),
+                   aulas_min=sum(l["dur"] for l in node["A_lessons"]), Q_min=node["Q_min"], R_min=node["R_min"])
+        for i, l in enumerate(node["A_lessons"], start=1):
+            yield dict(base, tipo="aula", data=iso, ordem=i, modulo=l["modulo"], aula=l["aula"], dur=l["dur"])
+        todays = sorted(reviews.get(d, []), key=lambda x: (-x["peso"], x["modulo"], x["aula"]))
+        for i, item in enumerate(todays, start=1):
+            yield dict(base, tipo="revisao", data=iso, ordem=i, modulo=item["modulo"], aula=item["aula"],
+                       assistida_em=item["watched_date"].isoformat(), dias_desde=(d - item["watched_date"]).days,
+                       offset=item.get("offset"))
+
+def export_jsonl(plan: dict, out_path: str, aluno: Optional[str] = None) -> str:
+    # Uma linha JSON por registro, escrita à medida que os dias são percorridos
+    with open(out_path, "w", encoding="utf-8", newline="\n") as f:
+        for rec in iter_plan_records(plan, aluno):
+            f.write(json.dumps(rec, ensure_ascii=False))
+            f.write("\n")
+    return out_path
+
+PARQUET_COLUMNS = ["aluno", "tipo", "data", "fase", "ordem", "modulo", "aula", "dur",
+                   "aulas_min", "Q_min", "R_min", "assistida_em", "dias_desde", "offset"]
+
+def export_parquet(plan: dict, out_path: str, aluno: Optional[str] = None, batch_rows: int = 5000) -> str:
+    """
+    Tabela única (colunas PARQUET_COLUMNS) com os registros de iter_plan_records, escrita em
+    lotes de batch_rows linhas (row groups) sem montar o cronograma inteiro em memória.
+    """
+    try:
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+    except Exception as e:
+        raise SystemExit("Instale pyarrow para exportar Parquet: pip install pyarrow") from e
+
+    schema = pa.schema([
+        ("aluno", pa.string()), ("tipo", pa.string()), ("data", pa.date32()), ("fase", pa.string()),
+        ("ordem", pa.int32()), ("modulo", pa.string()), ("aula", pa.string()), ("dur", pa.int32()),
+        ("aulas_min", pa.int32()), ("Q_min", pa.int32()), ("R_min", pa.int32()),
+        ("assistida_em", pa.date32()), ("dias_desde", pa.int32()), ("offset", pa.int32()),
+    ])
+
+    def _flush(writer, rows):
+        cols = {c: [r.get(c) for r in rows] for c in PARQUET_COLUMNS}
+        for c in ("data", "assistida_em"):
+            cols[c] = [date.fromisoformat(v) if v else None for v in cols[c]]
+        writer.write_table(pa.table(cols, schema=schema))
+
+    with pq.ParquetWriter(out_path, schema, compression="zstd") as writer:
+        rows = []
+        for rec in iter_plan_records(plan, aluno):
+            rows.append(rec)
+            if len(rows) >= batch_rows:
+                _flush(writer, rows)
+                rows = []
+        if rows:
+            _flush(writer, rows)
+    return out_path
+
+def _ics_escape(text: str) -> str:
+    return str(text).replace("\\", "\\\\").replace(";", "\\;").replace(",", "\\,").replace("\n", "\\n")
+
+def _ics_fold(line: str):
+    # RFC 5545: linhas de no máximo 75 octetos; continuação começa com espaço
+    data = line.encode("utf-8")
+    if len(data) <= 75:
+        yield line
+        return
+    chunk, size, first = [], 0, True
+    for ch in line:
+        n = len(ch.encode("utf-8"))
+        limit = 75 if first else 74
+        if size + n > limit:
+            yield ("" if first else " ") + "".join(chunk)
+            chunk, size, first = [], 0, False
+        chunk.append(ch)
+        size += n
+    if chunk:
+        yield ("" if first else " ") + "".join(chunk)
+
+def export_ics(params: dict, plan: dict, out_path: str, aluno: Optional[str] = None) -> str:
+    """
+    Calendário iCalendar com um evento de dia inteiro por dia de estudo: resumo com os minutos de
+    aulas/questões/revisão e descrição com as aulas e revisões do dia. UIDs estáveis por aluno/data,
+    para que uma nova importação atualize os eventos em vez de duplicá-los.
+    """
+    stamp = time.strftime("%Y%m%dT%H%M%SZ", time.gmtime())
+    owner = hashlib.sha1("|".join([aluno or "", params["tipo_prova"], params["data_inicio"].isoformat(),
+                                   params["data_prova"].isoformat()]).encode("utf-8")).hexdigest()[:12]
+    reviews = plan["reviews"]
+
+    def _lines():
+        yield "BEGIN:VCALENDAR"
+        yield "VERSION:2.0"
+        yield "PRODID:-//Gear//Cronograma com Revisao Espacada//PT"
+        yield "CALSCALE:GREGORIAN"
+        yield f"X-WR-CALNAME:{_ics_escape('Cronograma ' + params['tipo_prova'] + (' - ' + aluno if aluno else ''))}"
+        for n, d in enumerate(plan["study_days"], start=1):
+            node = plan["daily"][d]
+            aulas = node["A_lessons"]
+            a_min = sum(l["dur"] for l in aulas)
+            desc = ["Aulas para Assistir ({} min):".format(a_min)]
+            desc.extend("➙ {} - {} min".format(l["aula"], l["dur"]) for l in aulas)
+            desc.append("Treinamento de Questões ({} min)".format(node["Q_min"]))
+            desc.append("Revisão Espaçada ({} min):".format(node["R_min"]))
+            todays = sorted(reviews.get(d, []), key=lambda x: (-x["peso"], x["modulo"], x["aula"]))
+            desc.extend("{} (Assistida {}).".format(item["aula"], watched_label(d, item["watched_date"])) for item in todays)
+            yield "BEGIN:VEVENT"
+            yield f"UID:{owner}-{d.strftime('%Y%m%d')}@gear"
+            yield f"DTSTAMP:{stamp}"
+            yield f"DTSTART;VALUE=DATE:{d.strftime('%Y%m%d')}"
+            yield f"DTEND;VALUE=DATE:{(d + timedelta(days=1)).strftime('%Y%m%d')}"
+            yield "SUMMARY:" + _ics_escape(f"Estudo dia {n}: {len(aulas)} aulas ({a_min} min) + Q {node['Q_min']} / R {node['R_min']} min")
+            yield "DESCRIPTION:" + _ics_escape("\n".join(desc))
+            yield "TRANSP:TRANSPARENT"
+            yield "END:VEVENT"
+        yield "END:VCALENDAR"
+
+    with open(out_path, "w", encoding="utf-8", newline="") as f:
+        for line in _lines():
+            for part in _ics_fold(line):
+                f.write(part + "\r\n")
+    return out_path
+
+def export_plan(params: dict, plan: dict, out_base: str, formats=EXPORT_FORMATS, aluno: Optional[str] = None) -> dict:
+    # Grava as exportações pedidas ao lado do DOCX (mesmo nome-base); retorna {formato: caminho}
+    writers = {
+        "jsonl": lambda path: export_jsonl(plan, path, aluno),
+        "parquet": lambda path: export_parquet(plan, path, aluno),
+        "ics": lambda path: export_ics(params, plan, path, aluno),
+    }
+    out = {}
+    for fmt in formats:
+        if fmt not in writers:
+            raise ValueError(f"Formato de exportação desconhecido: {fmt} (use {', '.join(EXPORT_FORMATS)})")
+        out[fmt] = os.path.abspath(writers[fmt](f"{out_base}.{fmt}"))
+    return out
+
 def add_removed_checklist(doc: Document, removed_lessons):
     if not removed_lessons:
         return
@@ -1614,48 +2883,108 @@ def export_to_pdf(docx_path: str):
     # 3) Sem COM e sem docx2pdf
     return None
 
-# --- PERSISTIR a escolha dos offsets no config em main() e repassar adiante ---
-def main():
-    cfg = load_config()
-    params = read_inputs_from_gui(cfg)
-
-    cfg.update({
-        "minutos_por_dia": params["minutos_por_dia"],
-        "dias_por_semana": params["dias_por_semana"],
-        "data_inicio": format_date_br(params["data_inicio"]),
-        "data_prova": format_date_br(params["data_prova"]),
-        "tipo_prova": params["tipo_prova"],
-        "temas_path": params["temas_path"],
-        "aulas_path": params["aulas_path"],
-        "capa_path": params["capa_path"],
-        "orient_path": params["orient_path"],
-        "template_path": params.get("template_path",""),
-        "custom_weekdays": sorted(list(params["custom_weekdays"])) if params["custom_weekdays"] else [],
-        "review_offsets": params.get("review_offsets", DEFAULT_REVIEW_OFFSETS)
-    })
-    save_config(cfg)
+def parse_calendar_exclusions(cfg: dict):
+    # "feriados": ["DD/MM/AAAA", ...]; "bloqueios": [["DD/MM/AAAA", "DD/MM/AAAA"], ...] (intervalos inclusivos)
+    def _as_date(v):
+        return v if isinstance(v, date) else parse_date_br(str(v))
+    holidays = [_as_date(h) for h in (cfg.get("feriados") or [])]
+    blackouts = [(_as_date(b[0]), _as_date(b[1])) for b in (cfg.get("bloqueios") or [])]
+    return holidays, blackouts
+
+def params_from_config(cfg: dict) -> dict:
+    """Converte um dicionário no formato do scheduler_config.json (datas DD/MM/AAAA) em parâmetros do gerador."""
+    def _as_date(v):
+        return v if isinstance(v, date) else parse_date_br(str(v))
+    holidays, blackouts = parse_calendar_exclusions(cfg)
+    if cfg.get("banco") and not str(cfg.get("aluno") or "").strip():
+        # planos.aluno é único: sem nome, cada plano gravado substituiria o anterior
+        raise SystemExit('Informe "aluno" para gravar o plano no banco da turma ("banco").')
+    # "exportar": lista (ou texto "jsonl,ics") de formatos gravados ao lado do DOCX; vazio = nenhum
+    raw_exports = cfg.get("exportar")
+    exportar = [str(x).strip().lower() for x in (raw_exports.split(",") if isinstance(raw_exports, str) else raw_exports or [])
+                if str(x).strip()]
+    unknown = [fmt for fmt in exportar if fmt not in EXPORT_FORMATS]
+    if unknown:
+        # Validado antes de gerar: senão o erro só apareceria depois de DOCX/PDF/XLSX prontos
+        raise SystemExit(f"Formato de exportação desconhecido: {', '.join(unknown)} (use {', '.join(EXPORT_FORMATS)})")
+    return {
+        "minutos_por_dia": int(cfg["minutos_por_dia"]),
+        "dias_por_semana": int(cfg["dias_por_semana"]),
+        "data_inicio": _as_date(cfg["data_inicio"]),
+        "data_prova": _as_date(cfg["data_prova"]),
+        "tipo_prova": cfg.get("tipo_prova", "TEA"),
+        "temas_path": cfg.get("temas_path", ""),
+        "aulas_path": cfg.get("aulas_path", ""),
+        "capa_path": cfg.get("capa_path", ""),
+        "orient_path": cfg.get("orient_path", ""),
+        "template_path": (cfg.get("template_path") or "").strip(),
+        "custom_weekdays": {int(x) for x in (cfg.get("custom_weekdays") or [])},
+        "review_offsets": sorted(int(x) for x in cfg.get("review_offsets", DEFAULT_REVIEW_OFFSETS)),
+        "review_leveling": bool(cfg.get("review_leveling", False)),
+        "capa_dpi": int(cfg.get("capa_dpi", COVER_DPI)),
+        "orient_vector": bool(cfg.get("orientacoes_vetoriais", False)),
+        "exportar": exportar,
+        "aluno": cfg.get("aluno"),
+        # "banco": SQLite da turma (CohortStore) onde o plano é gravado após a geração; vazio = não grava
+        "banco": cfg.get("banco") or "",
+        # "pasta_temporaria": rascunho local onde os artefatos são montados (vazio = temp do sistema);
+        # "copia_em_segundo_plano": cópias para outro volume não bloqueiam a geração
+        "pasta_temporaria": cfg.get("pasta_temporaria") or "",
+        "copia_em_segundo_plano": bool(cfg.get("copia_em_segundo_plano", True)),
+        "feriados": holidays,
+        "bloqueios": blackouts,
+    }
 
+def resolve_default_template(params: dict):
     if not params.get("template_path"):
         here = os.path.abspath(os.path.dirname(__file__))
         default_tpl = os.path.join(here, "Estilo.dotx")
         if os.path.isfile(default_tpl):
             params["template_path"] = default_tpl
 
-    temas_df, aulas_df = read_dataframes(params["temas_path"], params["aulas_path"])
-    lessons_all, peso_map, custo_map, mod_order = build_lessons_queue(temas_df, aulas_df, params["tipo_prova"])
-
-    custom_weekdays = set(cfg.get("custom_weekdays", []))
-    study_days = generate_study_days(params["data_inicio"], params["data_prova"], params["dias_por_semana"], custom_weekdays if custom_weekdays else None)
+# Planos simulados recentes, por (impressão digital do tipo de prova no catálogo, entradas da simulação)
+PLAN_CACHE_SIZE = 32
+_PLAN_CACHE = OrderedDict()
+_PLAN_CACHE_LOCK = threading.Lock()
+
+def _invalidate_plans(old_index, new_index, changed_tipos):
+    # Catálogo trocado: descarta só os planos dos tipos de prova cujo conteúdo mudou
+    stale = {old_index["tipos"][t]["fingerprint"] for t in changed_tipos}
+    with _PLAN_CACHE_LOCK:
+        for key in [k for k in _PLAN_CACHE if k[0] in stale]:
+            del _PLAN_CACHE[key]
+
+CATALOG.add_listener(_invalidate_plans)
+
+def plan_schedule(params: dict) -> dict:
+    # Etapa de simulação: catálogo -> dias de estudo -> alocação (com remoções se necessário)
+    temas_df, aulas_df, catalog_index = load_catalog(params["temas_path"], params["aulas_path"])
+    cache_key = (catalog_index["tipos"][params["tipo_prova"]]["fingerprint"],
+                 json.dumps(simulation_inputs(params), sort_keys=True, ensure_ascii=False))
+    with _PLAN_CACHE_LOCK:
+        cached = _PLAN_CACHE.get(cache_key)
+        if cached is not None:
+            _PLAN_CACHE.move_to_end(cache_key)
+    if cached is not None:
+        # Mesmo resultado sem simular (nenhuma simulação nesta chamada)
+        return dict(cached, stats=dict(cached["stats"], simulacoes=0), catalog_version=catalog_index["version"])
+    lessons_all, peso_map, custo_map, mod_order = build_lessons_queue(temas_df, aulas_df, params["tipo_prova"], catalog_index)
+
+    custom_weekdays = set(params.get("custom_weekdays") or [])
+    study_days = cached_study_days(params)
     if not study_days:
         raise SystemExit("Não há dias de estudo dentro do intervalo fornecido.")
 
     # NOVO: extrair offsets selecionados (pode estar vazio)
     review_offsets = params.get("review_offsets", DEFAULT_REVIEW_OFFSETS)
 
+    stats = {}
     ok, daily, reviews, removed_lessons = try_fit_with_removals(
-        study_days, params["minutos_por_dia"], lessons_all, peso_map, custo_map, review_offsets
+        study_days, params["minutos_por_dia"], lessons_all, peso_map, custo_map, review_offsets, stats=stats
     )
     completo = ok and len(removed_lessons) == 0
+    if params.get("review_leveling"):
+        reviews = level_reviews(daily, study_days, reviews)
 
     total_A_min, total_QR_min = compute_totals(daily)
 
@@ -1663,62 +2992,1801 @@ def main():
     last_ws = week_start(study_days[-1])
     total_weeks = ((last_ws - first_ws).days // 7) + 1
 
+    plan = {
+        "study_days": study_days,
+        "daily": daily,
+        "reviews": reviews,
+        "removed_lessons": removed_lessons,
+        "peso_map": peso_map,
+        "completo": completo,
+        "total_A_min": total_A_min,
+        "total_QR_min": total_QR_min,
+        "total_weeks": total_weeks,
+        "label_dates": bool(custom_weekdays),
+        "stats": stats,
+        "catalog_version": catalog_index["version"],
+    }
+    with _PLAN_CACHE_LOCK:
+        _PLAN_CACHE[cache_key] = plan
+        while len(_PLAN_CACHE) > PLAN_CACHE_SIZE:
+            _PLAN_CACHE.popitem(last=False)
+    return dict(plan)
+
+def cached_study_days(params: dict):
+    custom_weekdays = frozenset(params.get("custom_weekdays") or [])
+    key = ("study_days", params["data_inicio"], params["data_prova"], params["dias_por_semana"], custom_weekdays,
+           tuple(params.get("feriados") or []), tuple(params.get("bloqueios") or []))
+    days = _RESIDENT_CACHE.get(key)
+    if days is None:
+        days = generate_study_days(params["data_inicio"], params["data_prova"], params["dias_por_semana"],
+                                   set(custom_weekdays) if custom_weekdays else None,
+                                   params.get("feriados"), params.get("bloqueios"))
+        _RESIDENT_CACHE[key] = days
+    return days
+
+def solve_min_minutes(params: dict, dias_options=None, max_minutes: int = 24 * 60):
+    """
+    Menor "minutos_por_dia" que gera Cronograma Completo (sem remoções) para as datas, dias,
+    tipo de prova e offsets dados. Busca exponencial + binária sobre simulate_schedule, reaproveitando
+    calendário e fila de aulas em cache. dias_options: lista de dias_por_semana a testar (padrão: o atual;
+    ignorado com dias fixos da semana). Retorna [{"dias_por_semana", "minutos_por_dia" (None se não couber
+    nem em max_minutes), "simulacoes"}].
+    """
+    temas_df, aulas_df, catalog_index = load_catalog(params["temas_path"], params["aulas_path"])
+    lessons_all, peso_map, _, _ = build_lessons_queue(temas_df, aulas_df, params["tipo_prova"], catalog_index)
+    review_offsets = params.get("review_offsets", DEFAULT_REVIEW_OFFSETS)
+    if params.get("custom_weekdays") or dias_options is None:
+        dias_options = [params["dias_por_semana"]]
+
+    results = []
+    for dps in dias_options:
+        study_days = cached_study_days(dict(params, dias_por_semana=int(dps)))
+        sims = 0
+
+        def fits(minutes):
+            nonlocal sims
+            sims += 1
+            return simulate_schedule(study_days, minutes, lessons_all, peso_map, review_offsets)[0]
+
+        best = None
+        if study_days:
+            lo, hi = 0, 30
+            while hi < max_minutes and not fits(hi):
+                lo, hi = hi, min(hi * 2, max_minutes)
+            if hi < max_minutes or fits(hi):
+                while hi - lo > 1:
+                    mid = (lo + hi) // 2
+                    if fits(mid):
+                        hi = mid
+                    else:
+                        lo = mid
+                best = hi
+        results.append({"dias_por_semana": int(dps), "minutos_por_dia": best, "simulacoes": sims})
+    return results
+
+def output_base(params: dict, plan: dict, out_dir: Optional[str] = None) -> str:
     out_base = "Cronograma_{}_{}_{}_{}xS_{}min".format(
-        "Completo" if completo else "Abreviado",
+        "Completo" if plan["completo"] else "Abreviado",
         params["tipo_prova"].replace(" ",""),
         params["data_inicio"].strftime("%Y-%m-%d") + "_" + params["data_prova"].strftime("%Y-%m-%d"),
         params["dias_por_semana"],
         params["minutos_por_dia"]
     ).replace(":", "-")
-
-    out_docx = out_base + ".docx"
-
+    if out_dir:
+        os.makedirs(out_dir, exist_ok=True)
+        out_base = os.path.join(out_dir, out_base)
+    return out_base
+
+def render_docx(params: dict, plan: dict, out_docx: str, interactive: bool = True,
+                schedule_workers: Optional[int] = 1) -> str:
+    # schedule_workers: processos para renderizar as semanas (None = todos os núcleos; 1 = serial)
     doc = load_document_with_template(params.get("template_path"))
     set_page_background(doc, "000000")
     ensure_a4(doc)
 
-    add_cover(doc, params["capa_path"])
+    add_cover(doc, params["capa_path"], params.get("capa_dpi", COVER_DPI))
     add_contracapa(doc, params["tipo_prova"], params["data_inicio"], params["data_prova"],
-                   params["minutos_por_dia"], params["dias_por_semana"], total_weeks,
-                   total_A_min, total_QR_min, completo, len(removed_lessons))
+                   params["minutos_por_dia"], params["dias_por_semana"], plan["total_weeks"],
+                   plan["total_A_min"], plan["total_QR_min"], plan["completo"], len(plan["removed_lessons"]))
 
-    label_dates = bool(custom_weekdays)
-    add_orientacoes(doc, params["orient_path"])
-    add_schedule(doc, study_days, daily, reviews, peso_map, label_dates)
-    if not completo:
-        add_removed_checklist(doc, removed_lessons)
+    add_orientacoes(doc, params["orient_path"], interactive=interactive, vector=params.get("orient_vector", False))
+    if schedule_workers == 1:
+        add_schedule(doc, plan["study_days"], plan["daily"], plan["reviews"], plan["peso_map"], plan["label_dates"])
+    else:
+        add_schedule_parallel(doc, params.get("template_path"), plan["study_days"], plan["daily"], plan["reviews"],
+                              plan["peso_map"], plan["label_dates"], workers=schedule_workers)
+    if not plan["completo"]:
+        add_removed_checklist(doc, plan["removed_lessons"])
 
+    # Estilos do template mesclados em memória; Word COM só como contingência
+    tpl = params.get("template_path")
+    merged = bool(tpl) and merge_template_styles(doc, tpl)
     doc.save(out_docx)
 
+    if tpl and not merged:
+        apply_template_styles_win(out_docx, tpl)
+    return out_docx
+
+def render_xlsx(params: dict, plan: dict, out_xlsx: str) -> str:
+    return export_excel_schedule(out_xlsx, plan["daily"], plan["study_days"], params["data_prova"])
+
+def generation_result(plan: dict, out_docx, pdf_path, out_xlsx) -> dict:
+    artefatos = {}
+    for kind, path in (("docx", out_docx), ("pdf", pdf_path), ("xlsx", out_xlsx)):
+        if path and os.path.isfile(path):
+            artefatos[kind] = os.path.getsize(path)
+    return {
+        "completo": plan["completo"],
+        "removed_count": len(plan["removed_lessons"]),
+        # Nivelamento (review_leveling): revisões remanejadas de dia e as que ficaram acima da cota diária
+        "revisoes_remanejadas": len(getattr(plan["reviews"], "deferrals", ())),
+        "revisoes_acima_da_cota": len(getattr(plan["reviews"], "overflow", ())),
+        "docx": os.path.abspath(out_docx) if out_docx else None,
+        "pdf": os.path.abspath(pdf_path) if pdf_path else None,
+        "xlsx": os.path.abspath(out_xlsx) if out_xlsx else None,
+        # Insumos de GenerationMetrics.record (etapas/cache são preenchidos por quem executa as etapas)
+        "metricas": {"simulacao": dict(plan.get("stats") or {}), "artefatos": artefatos, "etapas": {}},
+    }
+
+# --- PUBLICAÇÃO ATÔMICA DE ARTEFATOS (pastas sincronizadas: OneDrive, rede) ---
+
+PUBLISH_RETRIES = 5
+PUBLISH_IDLE_SECONDS = 2.0
+
+def new_scratch_dir(params: dict) -> str:
+    # Pasta local exclusiva do job; é removida quando o último artefato dela é publicado
+    root = params.get("pasta_temporaria") or os.path.join(tempfile.gettempdir(), "gear_rascunho")
+    os.makedirs(root, exist_ok=True)
+    return tempfile.mkdtemp(prefix="job_", dir=root)
+
+def _move_into_place(src: str, dest: str):
+    # Mesmo volume: os.replace é atômico. Outro volume: cópia para um nome oculto na pasta de destino
+    # e os.replace dali, de modo que o cliente de sincronização nunca vê um arquivo parcial.
+    try:
+        os.replace(src, dest)
+    except OSError:
+        tmp = os.path.join(os.path.dirname(dest), ".{}.{}.parcial".format(os.path.basename(dest), os.getpid()))
+        try:
+            shutil.copyfile(src, tmp)
+            os.replace(tmp, dest)
+        except BaseException:
+            with contextlib.suppress(OSError):
+                os.remove(tmp)
+            raise
+        os.remove(src)
+    with contextlib.suppress(OSError):
+        os.rmdir(os.path.dirname(src))
+
+def _move_with_retry(src: str, dest: str):
+    # Destino bloqueado (cliente de sincronização, Word com o arquivo aberto): novas tentativas com espera crescente
+    for attempt in range(PUBLISH_RETRIES):
+        try:
+            _move_into_place(src, dest)
+            return
+        except OSError:
+            if attempt == PUBLISH_RETRIES - 1:
+                raise
+            time.sleep(0.5 * 2 ** attempt)
+
+def _same_volume(src: str, dest_dir: str) -> bool:
+    try:
+        return os.stat(src).st_dev == os.stat(dest_dir).st_dev
+    except OSError:
+        return False
+
+class ArtifactPublisher:
+    """
+    Move artefatos montados na pasta de rascunho local para o destino final.
+    - Destino no mesmo volume: os.replace imediato (atômico, sem cópia); se o destino estiver bloqueado,
+      as novas tentativas seguem na thread de E/S.
+    - Outro volume (pasta de rede, unidade sincronizada): cópia numa thread de E/S em segundo plano,
+      com novas tentativas enquanto o destino estiver bloqueado (cliente de sincronização, Word aberto).
+    - background=False: tudo síncrono, com as mesmas novas tentativas; a última falha é propagada.
+    A thread não é daemon: o processo só termina depois das cópias pendentes; ela encerra sozinha quando ociosa.
+    """
+
+    def __init__(self):
+        self._queue = queue.Queue()
+        self._lock = threading.Lock()
+        self._thread = None
+        self._pending = {}
+        self.errors = {}
+
+    def publish(self, src: str, dest: str, background: bool = True) -> str:
+        dest = os.path.abspath(dest)
+        dest_dir = os.path.dirname(dest)
+        os.makedirs(dest_dir, exist_ok=True)
+        if not background:
+            _move_with_retry(src, dest)
+            return dest
+        if _same_volume(src, dest_dir):
+            try:
+                _move_into_place(src, dest)
+                return dest
+            except OSError:
+                pass
+        done = threading.Event()
+        with self._lock:
+            self.errors.pop(dest, None)
+            self._pending[dest] = done
+            self._queue.put((src, dest, done))
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name="gear-publicacao")
+                self._thread.start()
+        return dest
+
+    def _run(self):
+        while True:
+            try:
+                src, dest, done = self._queue.get(timeout=PUBLISH_IDLE_SECONDS)
+            except queue.Empty:
+                with self._lock:
+                    if self._queue.empty():
+                        self._thread = None
+                        return
+                continue
+            try:
+                _move_with_retry(src, dest)
+            except OSError as e:
+                # O arquivo montado fica no rascunho para recuperação manual
+                self.errors[dest] = f"{type(e).__name__}: {e} (cópia local: {src})"
+            finally:
+                with self._lock:
+                    self._pending.pop(dest, None)
+                done.set()
+
+    def wait(self, paths=None, timeout: Optional[float] = None) -> dict:
+        # Aguarda as cópias pendentes (todas ou só de paths); retorna {destino: erro} das que falharam
+        with self._lock:
+            keys = list(self._pending) if paths is None else [os.path.abspath(p) for p in paths if p]
+            events = [self._pending[k] for k in keys if k in self._pending]
+        for ev in events:
+            ev.wait(timeout)
+        return {k: self.errors[k] for k in keys if k in self.errors}
+
+PUBLISHER = ArtifactPublisher()
+
+def scratch_base(params: dict, dest_base: str) -> str:
+    # Mesmo nome de arquivo do destino, numa pasta de rascunho local nova
+    return os.path.join(new_scratch_dir(params), os.path.basename(dest_base))
+
+def result_paths(result: dict) -> list:
+    # Caminhos finais dos artefatos de um resultado (DOCX/PDF/XLSX e exportações)
+    paths = [result.get(key) for key in ("docx", "pdf", "xlsx")]
+    paths.extend((result.get("exportacoes") or {}).values())
+    return [p for p in paths if p]
+
+def wait_published(result: dict) -> dict:
+    """
+    Aguarda a publicação dos artefatos do resultado. Para processos do pool (servidor, --bulk), cuja
+    thread de E/S ninguém mais acompanha: falhas viram ok=False e "publicacao_erros" no resultado.
+    """
+    erros = PUBLISHER.wait(result_paths(result))
+    if erros:
+        result["ok"] = False
+        result["publicacao_erros"] = erros
+        result["error"] = "Falha ao copiar para o destino: " + "; ".join(f"{k}: {v}" for k, v in erros.items())
+    return result
+
+@contextlib.contextmanager
+def scratch_job(params: dict, dest_base: str):
+    # Rascunho do job (ver scratch_base): apagado se a geração falhar antes da publicação.
+    # Só uma publicação com falha deixa arquivos no rascunho, para recuperação manual.
+    out_base = scratch_base(params, dest_base)
+    try:
+        yield out_base
+    except BaseException:
+        shutil.rmtree(os.path.dirname(out_base), ignore_errors=True)
+        raise
+
+def publish_result(result: dict, dest_dir: str, background: bool = True) -> dict:
+    # Publica os artefatos do resultado em dest_dir e troca os caminhos do rascunho pelos finais
+    def _publish(path):
+        return PUBLISHER.publish(path, os.path.join(dest_dir, os.path.basename(path)), background)
+    for key in ("docx", "pdf", "xlsx"):
+        if result.get(key) and os.path.isfile(result[key]):
+            result[key] = _publish(result[key])
+    for fmt, path in (result.get("exportacoes") or {}).items():
+        if path and os.path.isfile(path):
+            result["exportacoes"][fmt] = _publish(path)
+    return result
+
+def run_generation(params: dict, out_dir: Optional[str] = None, interactive: bool = True, progress=None,
+                   schedule_workers: Optional[int] = None, plan: Optional[dict] = None) -> dict:
+    """
+    Executa o pipeline completo (catálogo -> simulação -> DOCX -> PDF -> XLSX) para um conjunto de parâmetros.
+    Usa os caches residentes (catálogo, template, rasters), de modo que execuções repetidas no mesmo
+    processo pagam apenas a simulação e a renderização.
+    progress: callback opcional progress(etapa, status) com status "inicio"/"fim".
+    schedule_workers: processos para o cronograma semanal (None = todos os núcleos).
+    plan: plano já simulado (p.ex. de load_plan); pula a etapa de simulação.
+    Os arquivos são montados numa pasta de rascunho local e publicados em out_dir ao final (PUBLISHER);
+    cópias para outro volume seguem em segundo plano: use PUBLISHER.wait antes de abrir os arquivos.
+    """
+    etapas = {}
+    started = {}
+    cache_before = dict(_ORIENT_CACHE_STATS)
+
+    def _notify(stage, status):
+        if status == "inicio":
+            started[stage] = time.perf_counter()
+        elif stage in started:
+            etapas[stage] = time.perf_counter() - started[stage]
+        if progress is not None:
+            try:
+                progress(stage, status)
+            except Exception:
+                pass
+
+    resolve_default_template(params)
+
+    if plan is None:
+        _notify("simulacao", "inicio")
+        plan = plan_schedule(params)
+        _notify("simulacao", "fim")
+
+    dest_base = output_base(params, plan, out_dir)
+    with scratch_job(params, dest_base) as out_base:
+        _notify("docx", "inicio")
+        out_docx = render_docx(params, plan, out_base + ".docx", interactive=interactive, schedule_workers=schedule_workers)
+        _notify("docx", "fim")
+
+        _notify("pdf", "inicio")
+        pdf_path = export_to_pdf(out_docx)
+        _notify("pdf", "fim")
+
+        # === SOMENTE exportar Excel se o PDF foi confirmado ===
+        out_xlsx = None
+        if pdf_path:
+            _notify("xlsx", "inicio")
+            out_xlsx = render_xlsx(params, plan, out_base + ".xlsx")
+            _notify("xlsx", "fim")
+
+        exportacoes = {}
+        if params.get("exportar"):
+            _notify("exportacao", "inicio")
+            exportacoes = export_plan(params, plan, out_base, params["exportar"], aluno=params.get("aluno"))
+            _notify("exportacao", "fim")
+
+        if params.get("banco"):
+            with CohortStore(params["banco"]) as store:
+                store.save_plan(params.get("aluno") or "", params, plan)
+
+        result = generation_result(plan, out_docx, pdf_path, out_xlsx)
+        result["exportacoes"] = exportacoes
+
+    publish_result(result, os.path.dirname(os.path.abspath(dest_base)), params.get("copia_em_segundo_plano", True))
+    result["metricas"]["etapas"] = etapas
+    result["metricas"]["cache_orientacoes"] = {k: _ORIENT_CACHE_STATS[k] - cache_before[k] for k in cache_before}
+    return result
+
+# --- PRÉ-VISUALIZAÇÃO RÁPIDA ---
+
+PREVIEW_WEEKS = 2
+
+def first_weeks(study_days, weeks: int):
+    # Dias de estudo contidos nas primeiras `weeks` semanas (segunda a domingo) do cronograma
+    if not study_days:
+        return []
+    limit = week_start(study_days[0]) + timedelta(days=7 * max(1, int(weeks)))
+    return study_days[:bisect_left(study_days, limit)]
+
+def render_preview(params: dict, plan: dict, weeks: int = PREVIEW_WEEKS, out_docx: Optional[str] = None):
+    """
+    DOCX reduzido para ajuste de parâmetros: contracapa com as métricas da simulação completa e as
+    primeiras `weeks` semanas do cronograma. Sem capa, orientações, checklist, PDF ou XLSX.
+    Salva em out_docx (retorna o caminho) ou, sem caminho, retorna os bytes do documento.
+    """
+    doc = load_document_with_template(params.get("template_path"))
+    set_page_background(doc, "000000")
+    ensure_a4(doc)
+    add_contracapa(doc, params["tipo_prova"], params["data_inicio"], params["data_prova"],
+                   params["minutos_por_dia"], params["dias_por_semana"], plan["total_weeks"],
+                   plan["total_A_min"], plan["total_QR_min"], plan["completo"], len(plan["removed_lessons"]))
+    add_schedule(doc, first_weeks(plan["study_days"], weeks), plan["daily"], plan["reviews"],
+                 plan["peso_map"], plan["label_dates"])
+
     tpl = params.get("template_path")
     if tpl:
+        merge_template_styles(doc, tpl)
+    if out_docx:
+        doc.save(out_docx)
+        return out_docx
+    buf = io.BytesIO()
+    doc.save(buf)
+    return buf.getvalue()
+
+def run_preview(params: dict, weeks: int = PREVIEW_WEEKS, out_dir: Optional[str] = None) -> dict:
+    """
+    Simulação completa + render_preview. Com out_dir grava "<nome do cronograma>_previa.docx";
+    sem out_dir devolve o DOCX em memória ("docx_bytes"), como usa o gear_app.py.
+    """
+    resolve_default_template(params)
+    plan = plan_schedule(params)
+    result = {
+        "completo": plan["completo"],
+        "removed_count": len(plan["removed_lessons"]),
+        "total_weeks": plan["total_weeks"],
+        "total_A_min": plan["total_A_min"],
+        "total_QR_min": plan["total_QR_min"],
+        "docx": None,
+        "docx_bytes": None,
+    }
+    if out_dir:
+        out_docx = output_base(params, plan, out_dir) + "_previa.docx"
+        result["docx"] = os.path.abspath(render_preview(params, plan, weeks, out_docx))
+    else:
+        result["docx_bytes"] = render_preview(params, plan, weeks)
+    return result
+
+def open_file(path: str):
+    # Abre o arquivo no aplicativo padrão do sistema
+    try:
+        if os.name == "nt":
+            os.startfile(path)  # type: ignore[attr-defined]
+        elif sys.platform == "darwin":
+            subprocess.Popen(["open", path])
+        else:
+            subprocess.Popen(["xdg-open", path])
+        return True
+    except Exception:
+        return False
+
+# --- PLANO SERIALIZADO (renderização desacoplada da simulação) ---
+
+PLAN_MAGIC = b"GEARPLAN"
+PLAN_FORMAT_VERSION = 2  # 2: revisões com o offset de origem
+PLAN_CODEC_MSGPACK = 1
+PLAN_CODEC_JSON = 2
+
+# Parâmetros que determinam o resultado da simulação (entram na impressão digital)
+PLAN_INPUT_KEYS = ("minutos_por_dia", "dias_por_semana", "data_inicio", "data_prova", "tipo_prova",
+                   "custom_weekdays", "review_offsets", "review_leveling", "feriados", "bloqueios")
+
+def params_to_config(params: dict) -> dict:
+    # Inverso de params_from_config: datas DD/MM/AAAA, conjuntos como listas (JSON/msgpack)
+    cfg = {}
+    for k, v in params.items():
+        if isinstance(v, date):
+            cfg[k] = format_date_br(v)
+        elif isinstance(v, (set, frozenset)):
+            cfg[k] = sorted(v)
+        else:
+            cfg[k] = v
+    cfg["feriados"] = [format_date_br(d) for d in (params.get("feriados") or [])]
+    cfg["bloqueios"] = [[format_date_br(a), format_date_br(b)] for a, b in (params.get("bloqueios") or [])]
+    return cfg
+
+def simulation_inputs(params: dict) -> dict:
+    cfg = params_to_config(params)
+    return {k: cfg.get(k) for k in PLAN_INPUT_KEYS}
+
+def plan_fingerprint(params: dict, catalog_version_: str) -> str:
+    inputs = simulation_inputs(params)
+    inputs["catalogo"] = catalog_version_
+    return hashlib.sha1(json.dumps(inputs, sort_keys=True, ensure_ascii=False).encode("utf-8")).hexdigest()
+
+def dump_plan(params: dict, plan: dict, path: Optional[str] = None) -> bytes:
+    """
+    Serializa parâmetros + resultado da simulação em formato binário versionado:
+    PLAN_MAGIC, versão, codec (msgpack se instalado; senão JSON) e corpo comprimido com zlib.
+    Aulas e módulos vão em tabelas; dias, alocações e revisões como índices inteiros.
+    Com path, grava o arquivo (substituição atômica). Retorna os bytes.
+    """
+    import zlib
+    study_days = plan["study_days"]
+    day_idx = {d: i for i, d in enumerate(study_days)}
+    epoch = study_days[0].toordinal() if study_days else 0
+
+    modules, mod_idx, lessons, lesson_idx = [], {}, [], {}
+
+    def _lesson(l):
+        key = (l["modulo"], l["aula"], l["dur"])
+        i = lesson_idx.get(key)
+        if i is None:
+            m = mod_idx.setdefault(l["modulo"], len(modules))
+            if m == len(modules):
+                modules.append(l["modulo"])
+            i = lesson_idx[key] = len(lessons)
+            lessons.append([m, l["aula"], int(l["dur"]), int(l.get("peso", plan["peso_map"].get(l["modulo"], 0)))])
+        return i
+
+    phases = sorted({plan["daily"][d]["phase"] for d in study_days})
+    allocations, reviews = [], []
+    by_aula = {}
+    for d in study_days:
+        node = plan["daily"][d]
+        allocations.append([_lesson(l) for l in node["A_lessons"]])
+        for l in node["A_lessons"]:
+            by_aula[(l["modulo"], l["aula"])] = l
+    for d in study_days:
+        flat = []
+        for it in plan["reviews"].get(d, []):
+            flat.extend((_lesson(by_aula.get((it["modulo"], it["aula"]), it | {"dur": 0})), day_idx[it["watched_date"]],
+                         it.get("offset")))
+        reviews.append(flat)
+
+    leveled = isinstance(plan["reviews"], LeveledReviews)
+    body = {
+        "fingerprint": plan_fingerprint(params, plan.get("catalog_version", "")),
+        "catalog_version": plan.get("catalog_version", ""),
+        "created": datetime.now().isoformat(timespec="seconds"),
+        "params": params_to_config(params),
+        "epoch": epoch,
+        "days": [d.toordinal() - epoch for d in study_days],
+        "phase_names": phases,
+        "phases": [phases.index(plan["daily"][d]["phase"]) for d in study_days],
+        "modules": modules,
+        "lessons": lessons,
+        "A": allocations,
+        "Q": [plan["daily"][d]["Q_min"] for d in study_days],
+        "R": [plan["daily"][d]["R_min"] for d in study_days],
+        "reviews": reviews,
+        "leveled": leveled,
+        "deferrals": [[_lesson(by_aula.get((x["modulo"], x["aula"]), x | {"dur": 0})), day_idx[x["due"]], day_idx[x["placed"]]]
+                      for x in (plan["reviews"].deferrals if leveled else [])],
+        "overflow": [[_lesson(by_aula.get((x["modulo"], x["aula"]), x | {"dur": 0})), day_idx[x["watched_date"]], day_idx[x["due"]],
+                      x.get("offset")]
+                     for x in (plan["reviews"].overflow if leveled else [])],
+        "removed": [_lesson(l) for l in plan["removed_lessons"]],
+        "peso_map": plan["peso_map"],
+        "completo": bool(plan["completo"]),
+        "total_A_min": plan["total_A_min"],
+        "total_QR_min": plan["total_QR_min"],
+        "total_weeks": plan["total_weeks"],
+        "label_dates": bool(plan["label_dates"]),
+        "stats": plan.get("stats") or {},
+    }
+    try:
+        import msgpack
+        codec, raw = PLAN_CODEC_MSGPACK, msgpack.packb(body, use_bin_type=True)
+    except ImportError:
+        codec, raw = PLAN_CODEC_JSON, json.dumps(body, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+    data = PLAN_MAGIC + bytes([PLAN_FORMAT_VERSION, codec]) + zlib.compress(raw, 6)
+    if path:
+        tmp = path + ".tmp"
+        with open(tmp, "wb") as f:
+            f.write(data)
+        os.replace(tmp, path)
+    return data
+
+def load_plan(source, expected_fingerprint: Optional[str] = None):
+    """
+    Lê um plano gravado por dump_plan (caminho ou bytes) e devolve (params, plan) prontos para
+    render_docx/render_xlsx/run_generation(plan=...)/replan_schedule, sem simular de novo.
+    expected_fingerprint: se informado e diferente, levanta ValueError (entradas mudaram).
+    """
+    import zlib
+    data = source if isinstance(source, (bytes, bytearray)) else read_file_cached(source)
+    if data[:len(PLAN_MAGIC)] != PLAN_MAGIC:
+        raise ValueError("Arquivo não é um plano do gerador.")
+    version, codec = data[len(PLAN_MAGIC)], data[len(PLAN_MAGIC) + 1]
+    if version > PLAN_FORMAT_VERSION:
+        raise ValueError(f"Plano na versão {version}; este gerador lê até a versão {PLAN_FORMAT_VERSION}.")
+    raw = zlib.decompress(data[len(PLAN_MAGIC) + 2:])
+    if codec == PLAN_CODEC_MSGPACK:
+        try:
+            import msgpack
+        except ImportError as e:
+            raise SystemExit("Plano gravado com msgpack: pip install msgpack") from e
+        body = msgpack.unpackb(raw, raw=False, strict_map_key=False)
+    elif codec == PLAN_CODEC_JSON:
+        body = json.loads(raw.decode("utf-8"))
+    else:
+        raise ValueError(f"Codec de plano desconhecido: {codec}")
+    if expected_fingerprint is not None and body["fingerprint"] != expected_fingerprint:
+        raise ValueError("O plano foi gerado com outras entradas (impressão digital diferente).")
+
+    params = params_from_config(body["params"])
+    epoch = body["epoch"]
+    study_days = [date.fromordinal(epoch + x) for x in body["days"]]
+    modules = body["modules"]
+    lessons = [{"aula": aula, "modulo": modules[m], "dur": dur, "peso": peso} for m, aula, dur, peso in body["lessons"]]
+
+    daily = OrderedDict()
+    for i, d in enumerate(study_days):
+        daily[d] = {"A_lessons": [lessons[j] for j in body["A"][i]], "Q_min": body["Q"][i], "R_min": body["R"][i],
+                    "phase": body["phase_names"][body["phases"][i]]}
+
+    def _item(j, w, offset=None):
+        l = lessons[j]
+        return {"aula": l["aula"], "modulo": l["modulo"], "watched_date": study_days[w], "peso": l["peso"],
+                "offset": offset}
+
+    # Versão 1 gravava as revisões em pares (aula, dia assistido), sem o offset
+    width = 3 if version >= 2 else 2
+    by_day = OrderedDict()
+    for i, d in enumerate(study_days):
+        flat = body["reviews"][i]
+        by_day[d] = [_item(*flat[k:k + width]) for k in range(0, len(flat), width)]
+    deferrals = [{"aula": lessons[j]["aula"], "modulo": lessons[j]["modulo"], "peso": lessons[j]["peso"],
+                  "due": study_days[due], "placed": study_days[placed], "shift": placed - due}
+                 for j, due, placed in body["deferrals"]]
+    overflow = [dict(_item(x[0], x[1], *x[3:]), due=study_days[x[2]]) for x in body["overflow"]]
+
+    plan = {
+        "study_days": study_days,
+        "daily": daily,
+        # Revisões já materializadas: mesma interface de LazyReviews/LeveledReviews
+        "reviews": LeveledReviews(by_day, deferrals, overflow),
+        "removed_lessons": [lessons[j] for j in body["removed"]],
+        "peso_map": body["peso_map"],
+        "completo": body["completo"],
+        "total_A_min": body["total_A_min"],
+        "total_QR_min": body["total_QR_min"],
+        "total_weeks": body["total_weeks"],
+        "label_dates": body["label_dates"],
+        "stats": body["stats"],
+        "catalog_version": body["catalog_version"],
+        "fingerprint": body["fingerprint"],
+    }
+    return params, plan
+
+# --- BANCO DA TURMA (SQLite) ---
+
+COHORT_SCHEMA = """
+CREATE TABLE IF NOT EXISTS planos (
+    id INTEGER PRIMARY KEY,
+    aluno TEXT NOT NULL UNIQUE,
+    tipo_prova TEXT, data_inicio TEXT, data_prova TEXT,
+    minutos_por_dia INTEGER, dias_por_semana INTEGER,
+    completo INTEGER, removidas INTEGER, fingerprint TEXT, gravado_em TEXT
+);
+CREATE TABLE IF NOT EXISTS dias (
+    plano_id INTEGER NOT NULL REFERENCES planos(id) ON DELETE CASCADE,
+    data TEXT NOT NULL, fase TEXT, aulas_min INTEGER, q_min INTEGER, r_min INTEGER
+);
+CREATE TABLE IF NOT EXISTS alocacoes (
+    plano_id INTEGER NOT NULL REFERENCES planos(id) ON DELETE CASCADE,
+    data TEXT NOT NULL, ordem INTEGER, modulo TEXT, aula TEXT, dur INTEGER
+);
+CREATE TABLE IF NOT EXISTS revisoes (
+    plano_id INTEGER NOT NULL REFERENCES planos(id) ON DELETE CASCADE,
+    data TEXT NOT NULL, ordem INTEGER, modulo TEXT, aula TEXT,
+    assistida_em TEXT, dias_desde INTEGER, offset_nominal INTEGER
+);
+CREATE INDEX IF NOT EXISTS ix_dias_data ON dias(data, plano_id);
+CREATE INDEX IF NOT EXISTS ix_alocacoes_data ON alocacoes(data, modulo);
+CREATE INDEX IF NOT EXISTS ix_alocacoes_plano ON alocacoes(plano_id);
+CREATE INDEX IF NOT EXISTS ix_revisoes_data ON revisoes(data, offset_nominal, modulo);
+CREATE INDEX IF NOT EXISTS ix_revisoes_plano ON revisoes(plano_id);
+"""
+
+class CohortStore:
+    """
+    Planos da turma num SQLite local, com tabelas indexadas por data (dias, alocações, revisões),
+    para perguntas sobre a turma inteira sem abrir as planilhas de cada aluno.
+    Cada aluno tem um plano: gravar de novo substitui o anterior. Gravações em lote numa transação.
+    """
+
+    def __init__(self, path: str):
+        import sqlite3
+        self.path = path
+        self._conn = sqlite3.connect(path, timeout=30)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute("PRAGMA foreign_keys=ON")
+        self._conn.executescript(COHORT_SCHEMA)
+
+    def _insert(self, aluno: str, params: dict, plan: dict):
+        cur = self._conn.cursor()
+        cur.execute("DELETE FROM planos WHERE aluno = ?", (aluno,))
+        cur.execute(
+            "INSERT INTO planos (aluno, tipo_prova, data_inicio, data_prova, minutos_por_dia, dias_por_semana,"
+            " completo, removidas, fingerprint, gravado_em) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+            (aluno, params["tipo_prova"], params["data_inicio"].isoformat(), params["data_prova"].isoformat(),
+             params["minutos_por_dia"], params["dias_por_semana"], int(bool(plan["completo"])),
+             len(plan["removed_lessons"]), plan.get("fingerprint") or plan_fingerprint(params, plan.get("catalog_version", "")),
+             datetime.now().isoformat(timespec="seconds")),
+        )
+        plano_id = cur.lastrowid
+        dias, alocacoes, revisoes = [], [], []
+        for rec in iter_plan_records(plan):
+            if rec["tipo"] == "dia":
+                dias.append((plano_id, rec["data"], rec["fase"], rec["aulas_min"], rec["Q_min"], rec["R_min"]))
+            elif rec["tipo"] == "aula":
+                alocacoes.append((plano_id, rec["data"], rec["ordem"], rec["modulo"], rec["aula"], rec["dur"]))
+            else:
+                revisoes.append((plano_id, rec["data"], rec["ordem"], rec["modulo"], rec["aula"], rec["assistida_em"],
+                                 rec["dias_desde"], rec["offset"]))
+        cur.executemany("INSERT INTO dias VALUES (?, ?, ?, ?, ?, ?)", dias)
+        cur.executemany("INSERT INTO alocacoes VALUES (?, ?, ?, ?, ?, ?)", alocacoes)
+        cur.executemany("INSERT INTO revisoes VALUES (?, ?, ?, ?, ?, ?, ?, ?)", revisoes)
+        return plano_id
+
+    def save_plan(self, aluno: str, params: dict, plan: dict) -> int:
+        with self._conn:
+            return self._insert(aluno, params, plan)
+
+    def save_many(self, items) -> int:
+        # items: iterável de (aluno, params, plan); uma única transação
+        n = 0
+        with self._conn:
+            for aluno, params, plan in items:
+                self._insert(aluno, params, plan)
+                n += 1
+        return n
+
+    def _rows(self, sql: str, args) -> list:
+        cur = self._conn.execute(sql, args)
+        cols = [c[0] for c in cur.description]
+        return [dict(zip(cols, row)) for row in cur.fetchall()]
+
+    def reviews_due(self, modulo: Optional[str] = None, offset: Optional[int] = None,
+                    start: Optional[date] = None, end: Optional[date] = None) -> list:
+        """
+        Revisões entre start e end (padrão: semana atual, segunda a domingo), opcionalmente de um
+        módulo (trecho do nome, sem diferenciar maiúsculas) e de um offset (D+N). Uma linha por aluno/aula.
+        """
+        if start is None:
+            today = date.today()
+            start = today - timedelta(days=today.weekday())
+        end = end or start + timedelta(days=6)
+        sql = ("SELECT p.aluno, r.data, r.modulo, r.aula, r.assistida_em, r.offset_nominal, r.dias_desde"
+               " FROM revisoes r JOIN planos p ON p.id = r.plano_id WHERE r.data BETWEEN ? AND ?")
+        args = [start.isoformat(), end.isoformat()]
+        if offset is not None:
+            sql += " AND r.offset_nominal = ?"
+            args.append(int(offset))
+        if modulo:
+            sql += " AND r.modulo LIKE ?"
+            args.append(f"%{modulo}%")
+        return self._rows(sql + " ORDER BY r.data, p.aluno, r.ordem", args)
+
+    def scheduled_on(self, day: Optional[date] = None, modulo: Optional[str] = None, aula: Optional[str] = None) -> list:
+        # Aulas programadas no dia (padrão: amanhã), opcionalmente filtradas por módulo/aula (trecho do nome)
+        day = day or date.today() + timedelta(days=1)
+        sql = ("SELECT p.aluno, a.data, a.ordem, a.modulo, a.aula, a.dur"
+               " FROM alocacoes a JOIN planos p ON p.id = a.plano_id WHERE a.data = ?")
+        args = [day.isoformat()]
+        if modulo:
+            sql += " AND a.modulo LIKE ?"
+            args.append(f"%{modulo}%")
+        if aula:
+            sql += " AND a.aula LIKE ?"
+            args.append(f"%{aula}%")
+        return self._rows(sql + " ORDER BY p.aluno, a.ordem", args)
+
+    def students(self) -> list:
+        return self._rows("SELECT aluno, tipo_prova, data_inicio, data_prova, completo, removidas, gravado_em"
+                          " FROM planos ORDER BY aluno", [])
+
+    def close(self):
+        self._conn.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+# --- REPLANEJAMENTO A PARTIR DE HOJE ---
+
+def _completed_matcher(completed):
+    # Aceita nomes de aula ("Aula X") ou pares (módulo, aula)
+    pairs, names = set(), set()
+    for c in completed or []:
+        if isinstance(c, (tuple, list)):
+            pairs.add((str(c[0]), str(c[1])))
+        else:
+            names.add(str(c))
+    return lambda l: (l["modulo"], l["aula"]) in pairs or l["aula"] in names
+
+def _day_signature(node, day_reviews):
+    return (
+        tuple((l["modulo"], l["aula"]) for l in node["A_lessons"]),
+        node["Q_min"], node["R_min"],
+        tuple(sorted((r["modulo"], r["aula"], r["watched_date"]) for r in day_reviews)),
+    )
+
+def replan_schedule(params: dict, plan: dict, completed, today: Optional[date] = None) -> dict:
+    """
+    Replaneja a partir de hoje: dias de estudo anteriores a 'today' ficam congelados e
+    simulate_schedule roda apenas sobre os dias restantes, com as aulas não concluídas
+    (atrasadas primeiro, na ordem original). Retorna um novo plano com "changed_weeks":
+    início das semanas cujo conteúdo mudou e que precisam ser renderizadas de novo.
+    """
+    today = today or date.today()
+    study_days = plan["study_days"]
+    daily_old = plan["daily"]
+    review_offsets = params.get("review_offsets", DEFAULT_REVIEW_OFFSETS)
+    is_done = _completed_matcher(completed)
+
+    cut = bisect_left(study_days, today)
+    past_days, future_days = study_days[:cut], study_days[cut:]
+    if not future_days:
+        raise SystemExit("Não há dias de estudo a partir de hoje para replanejar.")
+
+    pending = []
+    superseded = set()
+    for d in study_days:
+        for l in daily_old[d]["A_lessons"]:
+            if not is_done(l):
+                pending.append(l)
+                if d < today:
+                    superseded.add((l["modulo"], l["aula"], d))
+
+    peso_map = plan["peso_map"]
+    ok, daily_new, _, removed_now = try_fit_with_removals(
+        future_days, params["minutos_por_dia"], pending, peso_map, {}, review_offsets,
+        phase_offset=cut, phase_total_days=len(study_days)
+    )
+
+    daily = OrderedDict()
+    for d in past_days:
+        daily[d] = daily_old[d]
+    for d in future_days:
+        daily[d] = daily_new[d]
+    reviews = LazyReviews(daily, study_days, review_offsets, peso_map, skip=superseded)
+    if params.get("review_leveling"):
+        reviews = level_reviews(daily, study_days, reviews)
+
+    changed_weeks = []
+    for d in future_days:
+        old_sig = _day_signature(daily_old[d], plan["reviews"].get(d, []))
+        new_sig = _day_signature(daily[d], reviews.get(d, []))
+        ws = week_start(d)
+        if old_sig != new_sig and ws not in changed_weeks:
+            changed_weeks.append(ws)
+
+    removed_lessons = list(plan["removed_lessons"]) + list(removed_now)
+    total_A_min, total_QR_min = compute_totals(daily)
+    new_plan = dict(plan)
+    new_plan.update({
+        "daily": daily,
+        "reviews": reviews,
+        "removed_lessons": removed_lessons,
+        "completo": ok and not removed_lessons,
+        "total_A_min": total_A_min,
+        "total_QR_min": total_QR_min,
+        "changed_weeks": changed_weeks,
+        "today": today,
+    })
+    return new_plan
+
+def _paragraph_text(el) -> str:
+    return "".join(t.text or "" for t in el.iter(qn("w:t")))
+
+def _patch_contracapa(doc: Document, plan: dict):
+    # Atualiza os valores da contracapa que dependem da alocação
+    values = {
+        "Tempo total de aulas programadas: ": f"{plan['total_A_min']} minutos",
+        "Tempo total de questões + revisão: ": f"{plan['total_QR_min']} minutos",
+    }
+    nota = f"{len(plan['removed_lessons'])} aulas foram removidas por limitação de capacidade. A lista detalhada consta ao final do documento; é facultado ao aluno realizar substituições manuais conforme domínio individual dos temas."
+    tipo_p = None
+    nota_p = None
+    for p in doc.paragraphs:
+        runs = p.runs
+        if len(runs) >= 2 and runs[0].text in values:
+            runs[1].text = values[runs[0].text]
+        elif p.text in ("Cronograma Completo.", "Cronograma Abreviado."):
+            tipo_p = p
+        elif len(runs) >= 2 and runs[0].text == "Nota: " and "aulas foram removidas" in p.text:
+            nota_p = p
+    if tipo_p is None:
+        return
+    tipo_p.runs[0].text = "Cronograma Completo." if plan["completo"] else "Cronograma Abreviado."
+    if plan["completo"]:
+        if nota_p is not None:
+            nota_p._element.getparent().remove(nota_p._element)
+    elif nota_p is not None:
+        nota_p.runs[1].text = nota
+    else:
+        from docx.text.paragraph import Paragraph
+        new_p = OxmlElement("w:p")
+        tipo_p._element.addnext(new_p)
+        para = Paragraph(new_p, tipo_p._parent)
+        r = para.add_run("Nota: ")
+        r.bold = True
+        para.add_run(nota)
+
+def patch_docx_weeks(old_docx: str, out_docx: str, params: dict, plan: dict, changed_weeks) -> str:
+    """
+    Reaproveita o DOCX anterior e substitui apenas os trechos das semanas alteradas
+    (do título "Semana ..." até o título seguinte), além da contracapa e do checklist de removidos.
+    """
+    from docx.oxml import parse_xml
+    doc = Document(old_docx)
+    body = doc.element.body
+    children = [c for c in body.iterchildren() if c.tag != qn("w:sectPr")]
+
+    week_days = OrderedDict(iter_weeks(plan["study_days"]))
+    title_to_week = {
+        "Semana {} a {}".format(format_date_br(ws), format_date_br(ws + timedelta(days=6))): ws
+        for ws in week_days
+    }
+    starts = []
+    checklist_idx = None
+    for i, c in enumerate(children):
+        if c.tag != qn("w:p"):
+            continue
+        t = _paragraph_text(c)
+        if t in title_to_week:
+            starts.append((i, title_to_week[t]))
+        elif t == "Checklist de módulos removidos":
+            checklist_idx = i
+    if not starts:
+        raise ValueError(f"O DOCX não contém o cronograma semanal esperado: {old_docx}")
+
+    end_all = checklist_idx if checklist_idx is not None else len(children)
+    segments = {}
+    for k, (i, ws) in enumerate(starts):
+        j = starts[k + 1][0] if k + 1 < len(starts) else end_all
+        segments[ws] = children[i:j]
+
+    for ws in changed_weeks:
+        seg = segments.get(ws)
+        if not seg:
+            continue
+        days = week_days[ws]
+        fragment = _render_schedule_chunk(
+            params.get("template_path"), days,
+            OrderedDict((d, plan["daily"][d]) for d in days),
+            {d: plan["reviews"].get(d, []) for d in days},
+            plan["peso_map"], plan["label_dates"],
+        )
+        for xml in fragment:
+            seg[0].addprevious(parse_xml(xml))
+        for el in seg:
+            body.remove(el)
+
+    if checklist_idx is not None:
+        for el in children[checklist_idx:]:
+            body.remove(el)
+    if not plan["completo"]:
+        add_removed_checklist(doc, plan["removed_lessons"])
+
+    _patch_contracapa(doc, plan)
+    # Estilos do template mesclados em memória; Word COM só como contingência
+    tpl = params.get("template_path")
+    merged = bool(tpl) and merge_template_styles(doc, tpl)
+    doc.save(out_docx)
+
+    if tpl and not merged:
         apply_template_styles_win(out_docx, tpl)
+    return out_docx
+
+def run_replan(params: dict, completed, old_docx: Optional[str] = None, today: Optional[date] = None,
+               plan: Optional[dict] = None, out_dir: Optional[str] = None, interactive: bool = False) -> dict:
+    """
+    Replanejamento no meio do curso. Sem 'plan', a alocação original é reconstruída com os mesmos
+    parâmetros (a simulação é determinística). Com 'old_docx', só as semanas alteradas são renderizadas.
+    """
+    today = today or date.today()
+    resolve_default_template(params)
+    if plan is None:
+        plan = plan_schedule(params)
+    new_plan = replan_schedule(params, plan, completed, today)
+
+    dest_base = output_base(params, new_plan, out_dir) + "_Replanejado_" + today.strftime("%Y-%m-%d")
+    with scratch_job(params, dest_base) as out_base:
+        out_docx = out_base + ".docx"
+        if old_docx and os.path.isfile(old_docx):
+            patch_docx_weeks(old_docx, out_docx, params, new_plan, new_plan["changed_weeks"])
+        else:
+            render_docx(params, new_plan, out_docx, interactive=interactive)
+
+        pdf_path = export_to_pdf(out_docx)
+        out_xlsx = None
+        if pdf_path:
+            # A planilha usa fórmulas e mesclagens posicionais por linha: é regravada por inteiro
+            out_xlsx = render_xlsx(params, new_plan, out_base + ".xlsx")
+
+        result = generation_result(new_plan, out_docx, pdf_path, out_xlsx)
+
+    publish_result(result, os.path.dirname(os.path.abspath(dest_base)), params.get("copia_em_segundo_plano", True))
+    result["changed_weeks"] = [format_date_br(ws) for ws in new_plan["changed_weeks"]]
+    return result
+
+# --- PERSISTIR a escolha dos offsets no config em main() e repassar adiante ---
+def main():
+    cfg = load_config()
+    prefetcher = InputPrefetcher(capa_dpi=int(cfg.get("capa_dpi", COVER_DPI)),
+                                 orient_vector=bool(cfg.get("orientacoes_vetoriais", False)))
+    try:
+        params = read_inputs_from_gui(cfg, prefetcher)
+    except SystemExit:
+        prefetcher.close()
+        raise
+
+    cfg.update({
+        "minutos_por_dia": params["minutos_por_dia"],
+        "dias_por_semana": params["dias_por_semana"],
+        "data_inicio": format_date_br(params["data_inicio"]),
+        "data_prova": format_date_br(params["data_prova"]),
+        "tipo_prova": params["tipo_prova"],
+        "temas_path": params["temas_path"],
+        "aulas_path": params["aulas_path"],
+        "capa_path": params["capa_path"],
+        "orient_path": params["orient_path"],
+        "template_path": params.get("template_path",""),
+        "custom_weekdays": sorted(list(params["custom_weekdays"])) if params["custom_weekdays"] else [],
+        "review_offsets": params.get("review_offsets", DEFAULT_REVIEW_OFFSETS),
+        "review_leveling": params.get("review_leveling", False),
+        "orientacoes_vetoriais": params.get("orient_vector", False)
+    })
+    save_config(cfg)
 
-    pdf_path = export_to_pdf(out_docx)
+    # Feriados e bloqueios vêm apenas do scheduler_config.json
+    params["feriados"], params["bloqueios"] = parse_calendar_exclusions(cfg)
+    params["capa_dpi"] = int(cfg.get("capa_dpi", COVER_DPI))
 
-    # === SOMENTE exportar Excel se o PDF foi confirmado ===
-    out_xlsx = None
-    if pdf_path:
-        out_xlsx = out_base + ".xlsx"
-        export_excel_schedule(out_xlsx, daily, study_days, params["data_prova"])
+    # O que ainda estiver sendo pré-carregado termina aqui (sem carregar duas vezes)
+    prefetcher.wait()
+    prefetcher.close()
+    result = run_generation(params)
 
     msg = ["Cronograma gerado com sucesso."]
-    msg.append("Arquivo DOCX: {}".format(os.path.abspath(out_docx)))
-    if pdf_path:
-        msg.append("Arquivo PDF: {}".format(os.path.abspath(pdf_path)))
+    msg.append("Arquivo DOCX: {}".format(result["docx"]))
+    if result["pdf"]:
+        msg.append("Arquivo PDF: {}".format(result["pdf"]))
     else:
         msg.append("PDF não gerado automaticamente. Instale docx2pdf ou utilize Microsoft Word no Windows para converter.")
-    if out_xlsx:
-        msg.append("Arquivo XLSX: {}".format(os.path.abspath(out_xlsx)))
+    if result["xlsx"]:
+        msg.append("Arquivo XLSX: {}".format(result["xlsx"]))
+    if result["revisoes_remanejadas"] or result["revisoes_acima_da_cota"]:
+        msg.append("Nivelamento de revisões: {} remanejadas para dias próximos; {} acima da cota diária.".format(
+            result["revisoes_remanejadas"], result["revisoes_acima_da_cota"]))
     try:
         messagebox.showinfo("Concluído", "\n".join(msg))
     except Exception:
         pass
 
+    # Cópias para a pasta de destino (se em outro volume) terminam enquanto a mensagem é lida
+    erros = PUBLISHER.wait()
+    if erros:
+        try:
+            messagebox.showwarning("Cópia não concluída", "\n".join("{}: {}".format(k, v) for k, v in erros.items()))
+        except Exception:
+            pass
+
+
+# --- MÉTRICAS OPERACIONAIS (formato texto do Prometheus) ---
+
+METRIC_DEFS = OrderedDict([
+    ("gear_jobs_total", ("counter", "Jobs de geração por resultado (completo, abreviado, falha).")),
+    ("gear_stage_seconds", ("histogram", "Duração de cada etapa do pipeline em segundos.")),
+    ("gear_removal_search_simulations", ("histogram", "Simulações executadas por busca de remoções (try_fit_with_removals).")),
+    ("gear_forced_carryovers_total", ("counter", "Aulas forçadas além da cota diária (carryover) nos cronogramas gerados.")),
+    ("gear_force_debt_minutes_total", ("counter", "Minutos de force_debt descontados de Q/R nos cronogramas gerados.")),
+    ("gear_borrowed_minutes_total", ("counter", "Minutos emprestados das cotas de questões (Q) e revisão (R) para aulas.")),
+    ("gear_orientation_cache_requests_total", ("counter", "Consultas ao cache de rasters das orientações (hit/miss).")),
+    ("gear_orientation_cache_hit_ratio", ("gauge", "Fração de acertos do cache de rasters das orientações.")),
+    ("gear_artifact_bytes", ("histogram", "Tamanho dos arquivos gerados em bytes.")),
+])
+
+METRIC_BUCKETS = {
+    "gear_stage_seconds": (0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120),
+    "gear_removal_search_simulations": (1, 2, 3, 4, 6, 8, 12, 16, 24, 32, 64),
+    "gear_artifact_bytes": (1e5, 5e5, 1e6, 2.5e6, 5e6, 1e7, 2.5e7, 5e7, 1e8),
+}
+
+class GenerationMetrics:
+    """
+    Contadores e histogramas do gerador, agregados no processo que recebe os resultados
+    (servidor, lote, orquestrador). record(resultado) consome o bloco "metricas" de generation_result.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._counters = defaultdict(float)   # (nome, rótulos) -> valor
+        self._hists = {}                      # (nome, rótulos) -> [contagens por bucket, soma, total]
+
+    def inc(self, name: str, value: float = 1.0, **labels):
+        with self._lock:
+            self._counters[(name, tuple(sorted(labels.items())))] += value
+
+    def observe(self, name: str, value: float, **labels):
+        buckets = METRIC_BUCKETS[name]
+        with self._lock:
+            h = self._hists.setdefault((name, tuple(sorted(labels.items()))), [[0] * len(buckets), 0.0, 0])
+            for i, b in enumerate(buckets):
+                if value <= b:
+                    h[0][i] += 1
+            h[1] += value
+            h[2] += 1
+
+    def record(self, result: dict):
+        if not result.get("ok", True):
+            self.inc("gear_jobs_total", outcome="falha")
+        else:
+            self.inc("gear_jobs_total", outcome="completo" if result.get("completo") else "abreviado")
+        m = result.get("metricas") or {}
+        for stage, seconds in (m.get("etapas") or {}).items():
+            self.observe("gear_stage_seconds", seconds, stage=stage)
+        sim = m.get("simulacao") or {}
+        if sim.get("simulacoes"):  # 0 = plano vindo do cache, sem busca
+            self.observe("gear_removal_search_simulations", sim["simulacoes"])
+        self.inc("gear_forced_carryovers_total", sim.get("forcadas", 0))
+        self.inc("gear_force_debt_minutes_total", sim.get("force_debt", 0.0))
+        self.inc("gear_borrowed_minutes_total", sim.get("emprestado_Q", 0.0), quota="Q")
+        self.inc("gear_borrowed_minutes_total", sim.get("emprestado_R", 0.0), quota="R")
+        for outcome, n in (m.get("cache_orientacoes") or {}).items():
+            self.inc("gear_orientation_cache_requests_total", n, result=outcome)
+        for kind, size in (m.get("artefatos") or {}).items():
+            self.observe("gear_artifact_bytes", size, kind=kind)
+
+    def render(self) -> str:
+        def fmt_labels(labels, extra=()):
+            items = list(labels) + list(extra)
+            if not items:
+                return ""
+            return "{" + ",".join('{}="{}"'.format(k, str(v).replace("\\", "\\\\").replace('"', '\\"')) for k, v in items) + "}"
+
+        def fmt_num(v):
+            return repr(float(v)) if not float(v).is_integer() else str(int(v))
+
+        with self._lock:
+            counters = dict(self._counters)
+            hists = {k: (list(v[0]), v[1], v[2]) for k, v in self._hists.items()}
+        hits = counters.get(("gear_orientation_cache_requests_total", (("result", "hit"),)), 0.0)
+        misses = counters.get(("gear_orientation_cache_requests_total", (("result", "miss"),)), 0.0)
+        if hits + misses:
+            counters[("gear_orientation_cache_hit_ratio", ())] = hits / (hits + misses)
+
+        lines = []
+        for name, (kind, help_text) in METRIC_DEFS.items():
+            lines.append(f"# HELP {name} {help_text}")
+            lines.append(f"# TYPE {name} {kind}")
+            if kind == "histogram":
+                for (n, labels), (counts, total, count) in sorted(hists.items()):
+                    if n != name:
+                        continue
+                    for b, c in zip(METRIC_BUCKETS[name], counts):
+                        lines.append(f"{name}_bucket{fmt_labels(labels, [('le', fmt_num(b))])} {c}")
+                    lines.append(f"{name}_bucket{fmt_labels(labels, [('le', '+Inf')])} {count}")
+                    lines.append(f"{name}_sum{fmt_labels(labels)} {fmt_num(total)}")
+                    lines.append(f"{name}_count{fmt_labels(labels)} {count}")
+            else:
+                for (n, labels), value in sorted(counters.items()):
+                    if n == name:
+                        lines.append(f"{name}{fmt_labels(labels)} {fmt_num(value)}")
+        return "\n".join(lines) + "\n"
+
+    def dump(self, path: str) -> str:
+        # Grava em arquivo temporário e substitui (leitores, p.ex. node_exporter, nunca veem arquivo parcial)
+        tmp = path + ".tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            f.write(self.render())
+        os.replace(tmp, path)
+        return path
+
+METRICS = GenerationMetrics()
+
+
+# --- MODO SERVIDOR LOCAL: processos de trabalho com insumos residentes ---
+
+def warm_resources(params: dict):
+    # Carrega catálogo, template, capa e rasters das orientações nos caches residentes deste processo
+    if os.path.isfile(params.get("temas_path", "")) and os.path.isfile(params.get("aulas_path", "")):
+        load_catalog(params["temas_path"], params["aulas_path"])
+    tpl = params.get("template_path")
+    if tpl and os.path.isfile(tpl):
+        read_file_cached(tpl)
+    capa = params.get("capa_path")
+    if capa and os.path.isfile(capa):
+        prepared_cover_bytes(capa, dpi=params.get("capa_dpi", COVER_DPI))
+    orient = params.get("orient_path")
+    if orient and os.path.isfile(orient) and orient.lower().endswith(".pdf"):
+        if not (params.get("orient_vector") and vectorize_pdf_pages(orient)):
+            rasterize_pdf_pages(orient)
+
+def _server_worker_init(warm_cfg: dict):
+    try:
+        warm_resources(params_from_config(warm_cfg))
+    except Exception:
+        traceback.print_exc()
+    # Processos de longa duração: planilhas editadas entram sem reiniciar o servidor
+    CATALOG.watch()
+
+def _server_run_job(job_cfg: dict) -> dict:
+    try:
+        params = params_from_config(job_cfg)
+        # Paralelismo já vem do pool de processos do servidor: cronograma renderizado em série
+        result = run_generation(params, out_dir=job_cfg.get("out_dir"), interactive=False, schedule_workers=1)
+        result["ok"] = True
+        # A resposta só sai com os arquivos no destino final (ou com a falha da cópia)
+        return wait_published(result)
+    except SystemExit as se:
+        return {"ok": False, "error": str(se)}
+    except Exception as e:
+        return {"ok": False, "error": f"{type(e).__name__}: {e}"}
+
+def serve(host: str = "127.0.0.1", port: int = 8765, workers: int = 2, metrics_path: Optional[str] = None):
+    """
+    Servidor HTTP local. Cada processo do pool mantém catálogo, template e rasters residentes.
+      POST /generate  corpo JSON no formato do scheduler_config.json (+ "out_dir" opcional);
+                      campos ausentes são herdados do config salvo. Responde com os caminhos gerados.
+      GET  /health    estado do servidor.
+      GET  /metrics   métricas no formato texto do Prometheus.
+    """
+    from concurrent.futures import ProcessPoolExecutor
+    from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+    defaults = load_config()
+    pool = ProcessPoolExecutor(max_workers=workers, initializer=_server_worker_init, initargs=(defaults,))
+
+    class Handler(BaseHTTPRequestHandler):
+        def _reply(self, status: int, payload: dict):
+            body = json.dumps(payload, ensure_ascii=False).encode("utf-8")
+            self.send_response(status)
+            self.send_header("Content-Type", "application/json; charset=utf-8")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def do_GET(self):
+            if self.path == "/health":
+                self._reply(200, {"status": "ok", "workers": workers})
+            elif self.path == "/metrics":
+                body = METRICS.render().encode("utf-8")
+                self.send_response(200)
+                self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+            else:
+                self._reply(404, {"ok": False, "error": "rota desconhecida"})
+
+        def do_POST(self):
+            if self.path != "/generate":
+                self._reply(404, {"ok": False, "error": "rota desconhecida"})
+                return
+            try:
+                length = int(self.headers.get("Content-Length", "0"))
+                job = json.loads(self.rfile.read(length).decode("utf-8") or "{}")
+                if not isinstance(job, dict):
+                    raise ValueError("o corpo deve ser um objeto JSON")
+            except Exception as e:
+                self._reply(400, {"ok": False, "error": f"JSON inválido: {e}"})
+                return
+            job_cfg = dict(defaults)
+            job_cfg.update(job)
+            result = pool.submit(_server_run_job, job_cfg).result()
+            METRICS.record(result)
+            if metrics_path:
+                with contextlib.suppress(OSError):
+                    METRICS.dump(metrics_path)
+            # As métricas ficam no /metrics; a resposta traz só o resultado do job
+            self._reply(200 if result.get("ok") else 422, {k: v for k, v in result.items() if k != "metricas"})
+
+        def log_message(self, fmt, *args):
+            sys.stderr.write("[gear] " + (fmt % args) + "\n")
+
+    httpd = ThreadingHTTPServer((host, port), Handler)
+    print(f"Servidor do gerador em http://{host}:{port} ({workers} processos)")
+    try:
+        httpd.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        httpd.server_close()
+        pool.shutdown(wait=True)
+
+# --- GERAÇÃO EM LOTE PARA UMA TURMA (roster) ---
+
+WEEKDAY_ABBR_PT = ["seg", "ter", "qua", "qui", "sex", "sáb", "dom"]
+
+def _parse_int_list(v, labels=None):
+    # "1,7,30" / "1;7;30" / [1, 7, 30]; com labels, aceita também "Seg,Qua,Sex"
+    if v is None or (isinstance(v, float) and math.isnan(v)):
+        return []
+    if isinstance(v, (list, tuple, set)):
+        parts = list(v)
+    else:
+        parts = str(v).replace(";", ",").split(",")
+    out = []
+    for part in parts:
+        token = str(part).strip().lower()
+        if not token:
+            continue
+        if labels and token[:3] in labels:
+            out.append(labels.index(token[:3]))
+        else:
+            out.append(int(float(token)))
+    return out
+
+def read_roster(roster_path: str, defaults: dict):
+    """
+    Lê a planilha/CSV da turma: uma linha por aluno com as colunas (opcionais, exceto "aluno")
+    data_inicio, data_prova, minutos_por_dia, dias_por_semana, tipo_prova, custom_weekdays, review_offsets.
+    Colunas ausentes ou vazias herdam o scheduler_config.json. Retorna [(aluno, job_cfg)].
+    """
+    if roster_path.lower().endswith((".xlsx", ".xlsm")):
+        df = pd.read_excel(roster_path, engine="openpyxl", dtype=object)
+    else:
+        df = pd.read_csv(roster_path, dtype=object, sep=None, engine="python", encoding="utf-8-sig")
+    if "aluno" not in df.columns:
+        raise ValueError(f"A planilha da turma não contém a coluna obrigatória: aluno ({roster_path})")
+
+    jobs = []
+    for rec in df.to_dict("records"):
+        cfg = dict(defaults)
+        for key, value in rec.items():
+            if key == "aluno" or value is None or (isinstance(value, float) and math.isnan(value)) or str(value).strip() == "":
+                continue
+            if key in ("data_inicio", "data_prova"):
+                cfg[key] = format_date_br(value.date()) if isinstance(value, datetime) else str(value).strip()
+            elif key == "custom_weekdays":
+                cfg[key] = _parse_int_list(value, WEEKDAY_ABBR_PT)
+            elif key == "review_offsets":
+                cfg[key] = _parse_int_list(value)
+            elif key in ("minutos_por_dia", "dias_por_semana"):
+                cfg[key] = int(float(value))
+            else:
+                cfg[key] = value
+        jobs.append((str(rec["aluno"]).strip(), cfg))
+    return jobs
+
+def _bulk_job(aluno: str, job_cfg: dict, with_plan: bool = False) -> dict:
+    t0 = time.perf_counter()
+    result = _server_run_job(dict(job_cfg, aluno=aluno))
+    result["aluno"] = aluno
+    if with_plan and result.get("ok"):
+        # Plano serializado para o pai gravar no banco (plan_schedule devolve o plano em cache, sem simular)
+        params = params_from_config(dict(job_cfg, aluno=aluno))
+        result["plano"] = dump_plan(params, plan_schedule(params))
+    result["segundos"] = round(time.perf_counter() - t0, 3)
+    return result
+
+def run_bulk(roster_path: str, out_dir: str, workers: Optional[int] = None, db_path: Optional[str] = None) -> dict:
+    """
+    Gera DOCX/PDF/XLSX de todos os alunos da turma em paralelo.
+    Catálogo, template, capa e rasters das orientações são carregados UMA vez no processo pai;
+    com fork (Linux/macOS) os processos filhos os herdam por cópia-na-escrita. Sem fork (Windows),
+    cada processo aquece os próprios caches na inicialização. Grava manifest.json em out_dir.
+    db_path (ou "banco" no config): grava os planos no SQLite da turma, numa única transação no pai.
+    """
+    import gc
+    import multiprocessing as mp
+    from concurrent.futures import ProcessPoolExecutor
+
+    defaults = load_config()
+    db_path = db_path or defaults.get("banco") or None
+    # Só o pai escreve no banco (sem disputa de escrita entre processos)
+    defaults["banco"] = ""
+    jobs = read_roster(roster_path, defaults)
+    os.makedirs(out_dir, exist_ok=True)
+    # Uma só deduplicação para pastas e banco: o n-ésimo nome repetido vira pasta "Nome_n" e aluno "Nome (n)"
+    used = set()
+    deduped = []
+    for aluno, cfg in jobs:
+        base = "".join(ch if ch.isalnum() or ch in " -_." else "_" for ch in aluno).strip() or "aluno"
+        folder, n = base, 1
+        while folder in used:
+            n += 1
+            folder = f"{base}_{n}"
+        used.add(folder)
+        cfg["out_dir"] = os.path.join(out_dir, folder)
+        deduped.append((aluno if n == 1 else f"{aluno} ({n})", cfg))
+    jobs = deduped
+
+    # Carrega uma vez no pai cada combinação distinta de insumos
+    warmed = set()
+    for _, cfg in jobs:
+        inputs = tuple(cfg.get(k, "") for k in ("temas_path", "aulas_path", "template_path", "capa_path", "orient_path"))
+        if inputs in warmed:
+            continue
+        warmed.add(inputs)
+        try:
+            warm_resources(params_from_config(cfg))
+        except Exception:
+            traceback.print_exc()
+
+    workers = workers or os.cpu_count() or 1
+    if "fork" in mp.get_all_start_methods():
+        # Congela os objetos já criados para que a contagem de referências não copie as páginas compartilhadas
+        gc.freeze()
+        pool = ProcessPoolExecutor(max_workers=workers, mp_context=mp.get_context("fork"))
+    else:
+        pool = ProcessPoolExecutor(max_workers=workers, initializer=_server_worker_init, initargs=(defaults,))
+
+    t0 = time.perf_counter()
+    with pool:
+        results = list(pool.map(_bulk_job, [a for a, _ in jobs], [c for _, c in jobs], [bool(db_path)] * len(jobs)))
+    if hasattr(gc, "unfreeze"):
+        gc.unfreeze()
+    if db_path:
+        # Nomes já deduplicados junto com as pastas de saída
+        items = [(r["aluno"],) + load_plan(r.pop("plano")) for r in results if "plano" in r]
+        with CohortStore(db_path) as store:
+            store.save_many(items)
+    for r in results:
+        METRICS.record(r)
+    METRICS.dump(os.path.join(out_dir, "metricas.prom"))
+
+    manifest = {
+        "turma": os.path.abspath(roster_path),
+        "gerado_em": datetime.now().isoformat(timespec="seconds"),
+        "segundos": round(time.perf_counter() - t0, 3),
+        "total": len(results),
+        "sucesso": sum(1 for r in results if r.get("ok")),
+        "completos": sum(1 for r in results if r.get("completo")),
+        "alunos": results,
+    }
+    with open(os.path.join(out_dir, "manifest.json"), "w", encoding="utf-8") as f:
+        json.dump(manifest, f, ensure_ascii=False, indent=2)
+    return manifest
+
+
+# --- ORQUESTRAÇÃO ASSÍNCRONA DE LOTES (asyncio) ---
+
+# Classes de recurso exigidas por etapa; adquiridas sempre na ordem de RESOURCE_ORDER (sem deadlock)
+RESOURCE_ORDER = ("cpu", "disk", "conversor")
+STAGE_RESOURCES = OrderedDict([
+    ("simulacao", ("cpu",)),
+    ("docx", ("cpu", "disk")),
+    ("pdf", ("conversor",)),
+    ("xlsx", ("disk",)),
+    ("exportacao", ("disk",)),
+])
+
+def _render_docx_stage(params: dict, plan: dict, out_docx: str):
+    # Etapa "docx" do orquestrador: as orientações são rasterizadas no processo do pool, então o
+    # delta do cache de orientações volta junto com o caminho para entrar nas métricas do pai
+    before = dict(_ORIENT_CACHE_STATS)
+    out_docx = render_docx(params, plan, out_docx, interactive=False)
+    return out_docx, {k: _ORIENT_CACHE_STATS[k] - before[k] for k in before}
+
+class GenerationOrchestrator:
+    """
+    Orquestra muitos jobs de geração com asyncio.
+    - Cada etapa roda em um executor (por padrão, processos aquecidos com os insumos residentes).
+    - Concorrência limitada separadamente por classe de recurso (cpu, disk, conversor: docx2pdf/Word).
+    - submit() aguarda quando já há max_pending jobs em andamento (backpressure).
+    - Eventos de progresso por job/etapa: dicionários {"job", "stage", "status", "time", ...}
+      entregues a callbacks (add_listener) ou a filas asyncio (subscribe).
+    """
+
+    def __init__(self, cpu: Optional[int] = None, disk: int = 2, conversor: int = 1,
+                 max_pending: int = 32, executor=None, warm_cfg: Optional[dict] = None):
+        self._limits = {"cpu": cpu or os.cpu_count() or 2, "disk": disk, "conversor": conversor}
+        self._max_pending = max_pending
+        self._executor = executor
+        self._owns_executor = executor is None
+        self._warm_cfg = warm_cfg if warm_cfg is not None else load_config()
+        self._listeners = []
+        self._sems = None
+        self._pending = None
+        self._tasks = set()
+
+    def add_listener(self, callback):
+        self._listeners.append(callback)
+
+    def subscribe(self) -> "asyncio.Queue":
+        q = asyncio.Queue()
+        self._listeners.append(q.put_nowait)
+        return q
+
+    def _start(self):
+        if self._sems is not None:
+            return
+        self._sems = {k: asyncio.Semaphore(max(1, int(v))) for k, v in self._limits.items()}
+        self._pending = asyncio.Semaphore(max(1, int(self._max_pending)))
+        if self._executor is None:
+            from concurrent.futures import ProcessPoolExecutor
+            self._executor = ProcessPoolExecutor(
+                max_workers=self._limits["cpu"], initializer=_server_worker_init, initargs=(self._warm_cfg,)
+            )
+
+    def _emit(self, job_id, stage: str, status: str, **extra):
+        event = {"job": job_id, "stage": stage, "status": status, "time": time.time()}
+        event.update(extra)
+        for cb in list(self._listeners):
+            try:
+                cb(event)
+            except Exception:
+                pass
+
+    async def _run_stage(self, job_id, stage: str, fn, *args, timings: Optional[dict] = None):
+        needed = set(STAGE_RESOURCES[stage])
+        loop = asyncio.get_running_loop()
+        async with contextlib.AsyncExitStack() as stack:
+            for res in RESOURCE_ORDER:
+                if res in needed:
+                    await stack.enter_async_context(self._sems[res])
+            self._emit(job_id, stage, "inicio")
+            t0 = time.perf_counter()
+            try:
+                result = await loop.run_in_executor(self._executor, fn, *args)
+            except BaseException as e:
+                self._emit(job_id, stage, "erro", error=f"{type(e).__name__}: {e}")
+                raise
+            seconds = time.perf_counter() - t0
+            if timings is not None:
+                timings[stage] = seconds
+            self._emit(job_id, stage, "fim", seconds=round(seconds, 3))
+            return result
+
+    async def _run_job(self, job_id, params: dict, out_dir: Optional[str]):
+        timings = {}
+        try:
+            params = dict(params)
+            resolve_default_template(params)
+            plan = await self._run_stage(job_id, "simulacao", plan_schedule, params, timings=timings)
+            dest_base = output_base(params, plan, out_dir)
+            with scratch_job(params, dest_base) as out_base:
+                out_docx, cache_delta = await self._run_stage(job_id, "docx", _render_docx_stage, params, plan,
+                                                              out_base + ".docx", timings=timings)
+                pdf_path = await self._run_stage(job_id, "pdf", export_to_pdf, out_docx, timings=timings)
+                out_xlsx = None
+                if pdf_path:
+                    out_xlsx = await self._run_stage(job_id, "xlsx", render_xlsx, params, plan, out_base + ".xlsx",
+                                                     timings=timings)
+                exportacoes = {}
+                if params.get("exportar"):
+                    exportacoes = await self._run_stage(job_id, "exportacao", export_plan, params, plan, out_base,
+                                                        params["exportar"], params.get("aluno"), timings=timings)
+                result = generation_result(plan, out_docx, pdf_path, out_xlsx)
+                result["exportacoes"] = exportacoes
+            # Publicação no processo do orquestrador: a thread de E/S sobrevive ao fim da etapa
+            publish_result(result, os.path.dirname(os.path.abspath(dest_base)),
+                           params.get("copia_em_segundo_plano", True))
+            result["metricas"]["etapas"] = timings
+            result["metricas"]["cache_orientacoes"] = cache_delta
+            result["ok"] = True
+            # Job concluído só com os arquivos no destino; a espera não ocupa o laço nem os recursos das etapas
+            await asyncio.get_running_loop().run_in_executor(None, wait_published, result)
+            METRICS.record(result)
+            self._emit(job_id, "job", "fim", result=result)
+            return result
+        except BaseException as e:
+            if isinstance(e, asyncio.CancelledError):
+                raise
+            result = {"ok": False, "error": f"{type(e).__name__}: {e}", "metricas": {"etapas": timings}}
+            METRICS.record(result)
+            self._emit(job_id, "job", "erro", error=result["error"])
+            return result
+        finally:
+            self._pending.release()
+
+    async def submit(self, job_id, params: dict, out_dir: Optional[str] = None) -> "asyncio.Task":
+        # Backpressure: só aceita o job quando houver vaga entre os max_pending em andamento
+        self._start()
+        await self._pending.acquire()
+        self._emit(job_id, "fila", "aceito")
+        task = asyncio.get_running_loop().create_task(self._run_job(job_id, params, out_dir))
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+        return task
+
+    async def run_jobs(self, jobs, out_dir: Optional[str] = None) -> dict:
+        # jobs: iterável de (job_id, params); retorna {job_id: resultado}
+        tasks = {}
+        for job_id, params in jobs:
+            tasks[job_id] = await self.submit(job_id, params, out_dir)
+        results = await asyncio.gather(*tasks.values())
+        return dict(zip(tasks.keys(), results))
+
+    async def join(self):
+        if self._tasks:
+            await asyncio.gather(*list(self._tasks), return_exceptions=True)
+
+    def close(self):
+        if self._owns_executor and self._executor is not None:
+            self._executor.shutdown(wait=True)
+            self._executor = None
+
+    async def __aenter__(self):
+        self._start()
+        return self
+
+    async def __aexit__(self, *exc):
+        await self.join()
+        self.close()
+
+def run_cohort(jobs, out_dir: Optional[str] = None, listener=None, **limits) -> dict:
+    # Atalho síncrono: executa os jobs (job_id, params) com o orquestrador e retorna os resultados
+    async def _go():
+        async with GenerationOrchestrator(**limits) as orch:
+            if listener is not None:
+                orch.add_listener(listener)
+            return await orch.run_jobs(jobs, out_dir=out_dir)
+    return asyncio.run(_go())
+
+# Jobs concluídos (ou com erro) ficam consultáveis por este tempo antes de sair da memória
+SERVICE_JOB_TTL = 3600
+
+class GenerationService:
+    """
+    GenerationOrchestrator em um laço asyncio numa thread própria, para front ends síncronos (gear_app.py).
+    submit() retorna na hora um id de job; status(id) devolve o andamento por etapa para polling.
+    Uma instância pode ser compartilhada por várias sessões: o pool de processos é único.
+    Jobs terminados há mais de SERVICE_JOB_TTL segundos são descartados.
+    """
+
+    def __init__(self, **limits):
+        self._lock = threading.Lock()
+        self._jobs = {}
+        self._loop = asyncio.new_event_loop()
+        self._thread = threading.Thread(target=self._loop.run_forever, name="gear-geracao", daemon=True)
+        self._thread.start()
+        self._orch = GenerationOrchestrator(**limits)
+        self._orch.add_listener(self._on_event)
+
+    def _on_event(self, event: dict):
+        with self._lock:
+            job = self._jobs.get(event["job"])
+            if job is None:
+                return
+            job["events"].append(event)
+            if event["stage"] in job["stages"]:
+                job["stages"][event["stage"]] = event["status"]
+            if event["stage"] == "job":
+                job["status"] = "concluido" if event["status"] == "fim" else "erro"
+                job["result"] = event.get("result")
+                job["error"] = event.get("error")
+                job["finished"] = time.time()
+
+    def _on_submitted(self, job_id: str, fut):
+        # Falha antes de o job entrar no orquestrador (p.ex. ao criar o pool): sem isso ficaria em "fila" para sempre
+        error = "cancelado" if fut.cancelled() else fut.exception()
+        if error is None:
+            return
+        with self._lock:
+            job = self._jobs.get(job_id)
+            if job is not None and job["status"] == "fila":
+                job["status"] = "erro"
+                job["error"] = error if isinstance(error, str) else f"{type(error).__name__}: {error}"
+                job["finished"] = time.time()
+
+    def _evict_finished(self):
+        limit = time.time() - SERVICE_JOB_TTL
+        with self._lock:
+            for job_id in [k for k, job in self._jobs.items() if job.get("finished", limit) < limit]:
+                del self._jobs[job_id]
+
+    def submit(self, params: dict, out_dir: Optional[str] = None) -> str:
+        import uuid
+        job_id = uuid.uuid4().hex[:12]
+        with self._lock:
+            self._jobs[job_id] = {
+                "status": "fila",
+                "stages": OrderedDict((stage, None) for stage in STAGE_RESOURCES
+                                      if stage != "exportacao" or params.get("exportar")),
+                "events": [],
+                "result": None,
+                "error": None,
+                "created": time.time(),
+            }
+        self._evict_finished()
+        fut = asyncio.run_coroutine_threadsafe(self._orch.submit(job_id, params, out_dir), self._loop)
+        fut.add_done_callback(lambda f: self._on_submitted(job_id, f))
+        return job_id
+
+    def status(self, job_id: str) -> Optional[dict]:
+        """
+        Cópia do estado do job: {"status": "fila"/"executando"/"concluido"/"erro", "stages": {etapa: status},
+        "stage" (etapa atual), "progress" (0 a 1), "result", "error"}; None se o id for desconhecido.
+        """
+        with self._lock:
+            job = self._jobs.get(job_id)
+            if job is None:
+                return None
+            stages = OrderedDict(job["stages"])
+            snap = {"status": job["status"], "stages": stages, "result": job["result"], "error": job["error"]}
+        done = sum(1 for st in stages.values() if st == "fim")
+        running = [stage for stage, st in stages.items() if st == "inicio"]
+        if snap["status"] == "fila" and (done or running):
+            snap["status"] = "executando"
+        snap["stage"] = running[0] if running else None
+        snap["progress"] = 1.0 if snap["status"] == "concluido" else done / len(stages)
+        return snap
+
+    def forget(self, job_id: str):
+        with self._lock:
+            self._jobs.pop(job_id, None)
+
+    def close(self):
+        asyncio.run_coroutine_threadsafe(self._orch.join(), self._loop).result()
+        self._orch.close()
+        self._loop.call_soon_threadsafe(self._loop.stop)
+        self._thread.join()
+
+def read_artifacts(result: dict, remove: bool = False) -> dict:
+    # Lê os arquivos gerados para a memória ({"docx": bytes, ...}); remove=True apaga os arquivos
+    # e as pastas que ficarem vazias (p.ex. a pasta temporária do job)
+    data = {}
+    PUBLISHER.wait(result_paths(result or {}))
+    for key in ("docx", "pdf", "xlsx"):
+        path = (result or {}).get(key)
+        if path and os.path.isfile(path):
+            with open(path, "rb") as f:
+                data[key] = (os.path.basename(path), f.read())
+            if remove:
+                with contextlib.suppress(OSError):
+                    os.remove(path)
+                with contextlib.suppress(OSError):
+                    os.rmdir(os.path.dirname(path))
+    return data
+
+
+def _parse_cli_args(argv):
+    import argparse
+    ap = argparse.ArgumentParser(description="Gerador de Cronogramas com Revisão Espaçada")
+    ap.add_argument("--serve", action="store_true", help="inicia o servidor HTTP local de geração")
+    ap.add_argument("--host", default="127.0.0.1")
+    ap.add_argument("--port", type=int, default=8765)
+    ap.add_argument("--workers", type=int, default=max(1, (os.cpu_count() or 2) // 2))
+    ap.add_argument("--ingest", metavar="PASTA", help="agrega as planilhas de progresso (.xlsx) devolvidas pelos alunos")
+    ap.add_argument("--min-minutos", action="store_true",
+                    help="calcula, com o scheduler_config.json, os minutos diários mínimos para um Cronograma Completo (1 a 7 dias/semana)")
+    ap.add_argument("--bulk", metavar="TURMA", help="gera os cronogramas de todos os alunos da planilha/CSV da turma")
+    ap.add_argument("--saida", metavar="CAMINHO", help="CSV de saída do --ingest ou pasta de saída do --bulk")
+    ap.add_argument("--exportar", metavar="FORMATOS",
+                    help="só simula e exporta, sem DOCX/PDF/XLSX: lista separada por vírgula de jsonl, parquet, ics")
+    ap.add_argument("--salvar-plano", metavar="ARQUIVO", help="só simula (scheduler_config.json) e grava o plano serializado")
+    ap.add_argument("--renderizar", metavar="PLANO", help="gera DOCX/PDF/XLSX a partir de um plano gravado, sem simular")
+    ap.add_argument("--banco", metavar="SQLITE", help="banco da turma: preenchido pelo --bulk e lido pelas consultas")
+    ap.add_argument("--quem-revisa", metavar="MODULO", help="alunos com revisões do módulo na semana (use --offset e --dia)")
+    ap.add_argument("--quem-assiste", metavar="MODULO", help="alunos com aulas do módulo no dia (padrão: amanhã)")
+    ap.add_argument("--offset", type=int, help="offset da revisão (D+N) para --quem-revisa")
+    ap.add_argument("--dia", metavar="DD/MM/AAAA", help="dia do --quem-assiste ou da semana do --quem-revisa")
+    ap.add_argument("--metricas", metavar="ARQUIVO",
+                    help="grava as métricas (formato Prometheus) neste arquivo ao final do --bulk ou a cada job do --serve")
+    return ap.parse_args(argv)
+
 
 if __name__ == "__main__":
     try:
-        main()
+        args = _parse_cli_args(sys.argv[1:])
+        if args.serve:
+            serve(args.host, args.port, args.workers, metrics_path=args.metricas)
+        elif args.min_minutos:
+            for res in solve_min_minutes(params_from_config(load_config()), dias_options=range(1, 8)):
+                minutos = res["minutos_por_dia"] if res["minutos_por_dia"] is not None else "não cabe"
+                print(f"{res['dias_por_semana']} dias/semana: {minutos} min/dia ({res['simulacoes']} simulações)")
+        elif args.exportar:
+            params = params_from_config(load_config())
+            plan = plan_schedule(params)
+            out_base = output_base(params, plan, args.saida or ".")
+            for fmt, path in export_plan(params, plan, out_base, [f.strip() for f in args.exportar.split(",") if f.strip()]).items():
+                print(f"{fmt}: {path}")
+        elif args.quem_revisa or args.quem_assiste:
+            db = args.banco or load_config().get("banco")
+            if not db or not os.path.isfile(db):
+                raise SystemExit("Informe o banco da turma com --banco (ou \"banco\" no scheduler_config.json).")
+            dia = parse_date_br(args.dia) if args.dia else None
+            with CohortStore(db) as store:
+                if args.quem_revisa:
+                    start = dia - timedelta(days=dia.weekday()) if dia else None
+                    rows = store.reviews_due(args.quem_revisa, args.offset, start)
+                    for r in rows:
+                        print(f"{r['aluno']}\t{format_date_br(date.fromisoformat(r['data']))}\tD+{r['offset_nominal']}\t{r['aula']}")
+                else:
+                    rows = store.scheduled_on(dia, args.quem_assiste)
+                    for r in rows:
+                        print(f"{r['aluno']}\t{format_date_br(date.fromisoformat(r['data']))}\t{r['aula']}")
+            print(f"{len(rows)} resultado(s); {len({r['aluno'] for r in rows})} aluno(s)")
+        elif args.salvar_plano:
+            params = params_from_config(load_config())
+            plan = plan_schedule(params)
+            dump_plan(params, plan, args.salvar_plano)
+            print(f"Plano {'completo' if plan['completo'] else 'abreviado'} -> {os.path.abspath(args.salvar_plano)}")
+        elif args.renderizar:
+            params, plan = load_plan(args.renderizar)
+            result = run_generation(params, out_dir=args.saida, interactive=False, plan=plan)
+            for key in ("docx", "pdf", "xlsx"):
+                if result[key]:
+                    print(f"{key}: {result[key]}")
+        elif args.bulk:
+            manifest = run_bulk(args.bulk, args.saida or "cronogramas_turma", workers=args.workers, db_path=args.banco)
+            if args.metricas:
+                METRICS.dump(args.metricas)
+            print(f"{manifest['sucesso']}/{manifest['total']} alunos gerados em {manifest['segundos']}s "
+                  f"-> {os.path.abspath(args.saida or 'cronogramas_turma')}")
+        elif args.ingest:
+            import glob
+            files = sorted(glob.glob(os.path.join(args.ingest, "*.xlsx")))
+            df, errors = ingest_progress_workbooks(files, workers=os.cpu_count())
+            out_csv = args.saida or "progresso_turma.csv"
+            df.to_csv(out_csv, index=False, encoding="utf-8-sig")
+            print(f"{len(files)} planilhas, {len(df)} aulas -> {os.path.abspath(out_csv)}")
+            for path, err in errors.items():
+                print(f"Falha em {path}: {err}")
+        else:
+            main()
     except SystemExit as se:
         print(str(se))
     except Exception as e:
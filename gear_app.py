@@ -1,9 +1,78 @@
 import streamlit as st
 import json
-from Gear_com_revisao_V28 import main_function  # ajuste para o nome real da função principal do Gear
+import os
+import sys
+import shutil
+import time
+import tempfile
+import hashlib
+import importlib.util
+import multiprocessing
+
+GEAR_SCRIPT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "Gear com revisão - V28.py")
+
+
+@st.cache_resource
+def load_gear():
+    # O script principal tem espaços/acentos no nome: carrega como módulo "gear"
+    spec = importlib.util.spec_from_file_location("gear", GEAR_SCRIPT)
+    module = importlib.util.module_from_spec(spec)
+    # Registrado antes de executar: as etapas enviadas ao pool de processos são serializadas como "gear.<função>"
+    sys.modules["gear"] = module
+    spec.loader.exec_module(module)
+    return module
+
+
+@st.cache_resource
+def generation_service():
+    # Pool de geração compartilhado por todas as sessões do app
+    gear = load_gear()
+    workers = max(1, (os.cpu_count() or 2) // 2)
+    if multiprocessing.get_start_method() != "fork":
+        # spawn (Windows/macOS): os processos filhos não conseguem importar "gear"; etapas em threads
+        from concurrent.futures import ThreadPoolExecutor
+        return gear.GenerationService(cpu=workers, executor=ThreadPoolExecutor(max_workers=workers))
+    return gear.GenerationService(cpu=workers)
+
+
+UPLOAD_DIR = os.path.join(tempfile.gettempdir(), "gear_uploads")
+UPLOAD_MAX_AGE = 24 * 3600  # segundos sem reenvio até o arquivo ser apagado
+
+
+def prune_uploads():
+    # Apaga os envios antigos (de qualquer sessão) para a pasta não crescer sem limite
+    limit = time.time() - UPLOAD_MAX_AGE
+    for name in os.listdir(UPLOAD_DIR):
+        path = os.path.join(UPLOAD_DIR, name)
+        try:
+            if os.path.getmtime(path) < limit:
+                os.remove(path)
+        except OSError:
+            pass
+
+
+def upload_to_path(uploaded, fallback=""):
+    # Grava o arquivo enviado num caminho derivado do conteúdo (as funções do Gear trabalham com caminhos).
+    # Reruns e reenvios do mesmo arquivo reaproveitam o caminho e, com ele, os caches do Gear.
+    if uploaded is None:
+        return fallback or ""
+    data = uploaded.getvalue()
+    suffix = os.path.splitext(uploaded.name)[1].lower()
+    os.makedirs(UPLOAD_DIR, exist_ok=True)
+    path = os.path.join(UPLOAD_DIR, hashlib.sha1(data).hexdigest() + suffix)
+    if not os.path.isfile(path):
+        prune_uploads()
+        tmp = "{}.{}.parcial".format(path, os.getpid())
+        with open(tmp, "wb") as f:
+            f.write(data)
+        os.replace(tmp, path)
+    return path
+
 
 st.set_page_config(page_title="Gear Revisão Espaciada", page_icon="📚")
 
+gear = load_gear()
+
 st.title("📅 Gerador de Cronograma – Gear com Revisão Espaciada")
 
 # Lê ou cria config padrão
@@ -24,19 +93,95 @@ aulas_path = st.file_uploader("Arquivo de aulas (.xlsx)", type="xlsx")
 capa_path = st.file_uploader("Capa (PNG)", type="png")
 orient_path = st.file_uploader("Orientações (PDF)", type="pdf")
 template_path = st.file_uploader("Template .dotx (opcional)", type="dotx")
+orient_vetor = st.checkbox("Orientações em PDF como vetor (SVG)", value=config.get("orientacoes_vetoriais", False))
+semanas_previa = st.number_input("Semanas na prévia", min_value=1, max_value=12, value=gear.PREVIEW_WEEKS)
 
-if st.button("Gerar Cronograma"):
-    st.write("Gerando cronograma...")
 
-    config = {
+def build_params():
+    # Arquivos não enviados caem nos caminhos do scheduler_config.json
+    cfg = dict(config)
+    cfg.update({
         "minutos_por_dia": minutos_por_dia,
         "dias_por_semana": dias_por_semana,
         "data_inicio": data_inicio.strftime("%d/%m/%Y"),
         "data_prova": data_prova.strftime("%d/%m/%Y"),
         "tipo_prova": tipo_prova,
-        "review_offsets": [30],  # fixa ou adicione controles para isso
-    }
+        "review_offsets": config.get("review_offsets", [30]),
+        "temas_path": upload_to_path(temas_path, config.get("temas_path")),
+        "aulas_path": upload_to_path(aulas_path, config.get("aulas_path")),
+        "capa_path": upload_to_path(capa_path, config.get("capa_path")),
+        "orient_path": upload_to_path(orient_path, config.get("orient_path")),
+        "template_path": upload_to_path(template_path, config.get("template_path")),
+        "orientacoes_vetoriais": orient_vetor,
+    })
+    return gear.params_from_config(cfg)
+
+
+col_previa, col_html, col_gerar = st.columns(3)
+
+if col_html.button("Visualizar no navegador"):
+    if data_inicio is None or data_prova is None:
+        st.error("Informe a data de início e a data da prova.")
+    else:
+        params = build_params()
+        gear.resolve_default_template(params)
+        plan = gear.plan_schedule(params)
+        st.markdown("<style>{}</style>".format(gear.HTML_STYLE), unsafe_allow_html=True)
+        # Semana a semana: a página começa a aparecer antes do fim do cronograma
+        for chunk in gear.iter_plan_html(params, plan, standalone=False):
+            st.markdown("<div class='cronograma'>{}</div>".format(chunk), unsafe_allow_html=True)
+
+if col_previa.button("Pré-visualizar"):
+    if data_inicio is None or data_prova is None:
+        st.error("Informe a data de início e a data da prova.")
+    else:
+        res = gear.run_preview(build_params(), weeks=int(semanas_previa))
+        status = "Completo" if res["completo"] else "Abreviado ({} aulas removidas)".format(res["removed_count"])
+        st.info("Cronograma {} – {} semanas, {} min de aulas e {} min de questões/revisão.".format(
+            status, res["total_weeks"], res["total_A_min"], res["total_QR_min"]))
+        st.download_button("Baixar prévia (DOCX)", res["docx_bytes"], file_name="Cronograma_previa.docx",
+                           mime="application/vnd.openxmlformats-officedocument.wordprocessingml.document")
+
+if col_gerar.button("Gerar Cronograma"):
+    if data_inicio is None or data_prova is None:
+        st.error("Informe a data de início e a data da prova.")
+    else:
+        # Não bloqueia a sessão: o job roda no pool em segundo plano e a página acompanha por polling
+        st.session_state["job_dir"] = tempfile.mkdtemp(prefix="gear_")
+        st.session_state["job_id"] = generation_service().submit(build_params(), out_dir=st.session_state["job_dir"])
+        st.session_state.pop("artefatos", None)
+
+ETAPAS = {"simulacao": "Simulação", "docx": "Documento Word", "pdf": "PDF", "xlsx": "Planilha",
+          "exportacao": "Exportações"}
+
+job_id = st.session_state.get("job_id")
+if job_id:
+    job = generation_service().status(job_id)
+    if job is None:
+        st.session_state.pop("job_id")
+        shutil.rmtree(st.session_state.pop("job_dir", ""), ignore_errors=True)
+    elif job["status"] in ("fila", "executando"):
+        st.progress(job["progress"], text="Gerando cronograma... {}".format(ETAPAS.get(job["stage"], "na fila")))
+        time.sleep(0.5)
+        st.rerun()
+    else:
+        if job["status"] == "concluido" and (job["result"] or {}).get("ok"):
+            # Arquivos lidos para a memória uma única vez; os downloads saem da sessão
+            st.session_state["artefatos"] = gear.read_artifacts(job["result"], remove=True)
+            st.session_state["nivelamento"] = (job["result"].get("revisoes_remanejadas", 0),
+                                               job["result"].get("revisoes_acima_da_cota", 0))
+        else:
+            st.error("Falha na geração: {}".format(job["error"] or (job["result"] or {}).get("error")))
+        generation_service().forget(job_id)
+        st.session_state.pop("job_id")
+        shutil.rmtree(st.session_state.pop("job_dir", ""), ignore_errors=True)
 
-    # chama a função principal do Gear
-    main_function(config)
+if "artefatos" in st.session_state:
     st.success("Cronograma gerado com sucesso!")
+    remanejadas, acima = st.session_state.get("nivelamento", (0, 0))
+    if remanejadas or acima:
+        st.info("Nivelamento de revisões: {} remanejadas para dias próximos; {} acima da cota diária.".format(remanejadas, acima))
+    for key, label in (("docx", "DOCX"), ("pdf", "PDF"), ("xlsx", "XLSX")):
+        if key in st.session_state["artefatos"]:
+            nome, dados = st.session_state["artefatos"][key]
+            st.download_button("Baixar {}".format(label), dados, file_name=nome, key="baixar_" + key)